@@ -1,11 +1,13 @@
 
+from concurrent.futures import ThreadPoolExecutor
 import filters as f
 import numpy as np
+import cv2
+from image_filters import binIndices
 from log import ConsoleLog as log
-from skimage import io, feature, color
 
 
-def calcGlcm(image, distancesCount:int=5, anglesCount: int=None, anglesStep:float=45):
+def calcGlcm(image, distancesCount:int=5, anglesCount: int=None, anglesStep:float=45, **kwargs):
     '''
     Calculates GLCM for an image over number of distances and number of angles.
     Distances range [1, distancesCount] with step 1
@@ -15,74 +17,451 @@ def calcGlcm(image, distancesCount:int=5, anglesCount: int=None, anglesStep:floa
      7: every 30°
      9: every 22.5°
     13: every 15°
-    See calcGlcmFor() for result format
+    See calcGlcmFor() for result format and kwargs
     '''
+    distances, angles = glcmAxes(distancesCount, anglesCount, anglesStep)
+    return calcGlcmFor(image, distances, angles, **kwargs)
+
+def glcmAxes(distancesCount: int=5, anglesCount: int=None, anglesStep: float=45) -> tuple:
+    '''The (distances, angles) calcGlcm() uses.'''
     if anglesCount is None:
         anglesCount = int(180/anglesStep)+1
-    distances = np.arange(1, distancesCount+1)
-    angles = np.linspace(0, np.pi, anglesCount)
-    return calcGlcmFor(image, distances, angles)
+    return np.arange(1, distancesCount+1), np.linspace(0, np.pi, anglesCount)
+
+GLCM_PROPS = ('contrast', 'dissimilarity', 'homogeneity', 'energy')
+GLCM_FEATURES = GLCM_PROPS + (
+    'ASM', 'correlation', 'entropy', 'mean', 'variance', 'std', 'cluster shade', 'cluster prominence',
+    'sum average', 'sum variance', 'sum entropy', 'difference variance', 'difference entropy',
+    'IMC1', 'IMC2', 'max probability')
+GLCM_QUANTIZATIONS = ('uniform', 'equal')
+
+def quantize(image, levels: int, quantization: str='uniform', mask=None) -> np.ndarray:
+    '''
+    Grey levels of an image reduced to levels (e.g. 8, 16, 32 or 64) codes,
+    uint8 for up to 256 levels. 'uniform' splits the value range of the dtype
+    evenly, 'equal' into bins holding about as many pixels each (of the mask's
+    pixels, and of all the images of a stack together).
+    '''
+    image = np.asarray(image)
+    if quantization == 'uniform':
+        codes = binIndices(image, levels)
+    elif quantization == 'equal':
+        counted = image if mask is None else image[mask]
+        if image.dtype.kind == 'u' and image.dtype.itemsize <= 2:
+            counts = np.bincount(counted.ravel(), minlength=int(image.max(initial=0)) + 1)
+            values = None
+        else:
+            values, counts = np.unique(counted, return_counts=True)
+        # the bin of a value is the share of the pixels below it
+        below = np.cumsum(counts) - counts
+        codes = np.minimum(below * levels // max(1, counts.sum()), levels - 1)
+        if values is None:
+            codes = codes[image]
+        else:
+            codes = codes[np.clip(np.searchsorted(values, image), 0, len(values) - 1)]
+    else:
+        raise ValueError(f'Unknown quantization {quantization}, expected one of {GLCM_QUANTIZATIONS}')
+    return codes.astype(np.uint8 if levels <= 256 else np.intp)
+
+def glcmOffsets(distances, angles) -> np.ndarray:
+    '''(row, column) pixel offsets like scikit-image's graycomatrix(), as a (distances, angles, 2) array.'''
+    distances = np.asarray(distances, dtype=np.float64)[:, None]
+    angles = np.asarray(angles, dtype=np.float64)[None, :]
+    return np.stack([np.round(np.sin(angles) * distances), np.round(np.cos(angles) * distances)],
+                    axis=-1).astype(np.intp)
+
+GLCM_CHUNK_BYTES = 64 << 20  # counting scratch of a batch of regions
+
+def glcmChunk(distances, angles, levels: int=256) -> int:
+    '''Number of regions graycomatrices() and calcGlcmFor() count at a time.'''
+    # the unique offsets' bincounts plus the (distances, angles) matrices made from them
+    perRegion = 3 * len(distances) * len(angles) * (levels + 1) ** 2 * 4
+    return max(1, GLCM_CHUNK_BYTES // perRegion)
+
+def graycomatrices(image, distances, angles, levels: int=256, mask=None, batched: bool=False) -> np.ndarray:
+    '''
+    float32 co-occurrence counts of an image for every distance and angle, like
+    scikit-image's graycomatrix() but as a (distances, angles, levels, levels)
+    array: one OpenCV histogram per distinct offset for images, one bincount
+    over every image for stacks, repeated and opposite offsets counted once. With
+    batched, image is an (N, h, w) stack (e.g. image_filters.RegionCrop) and
+    the result (N, distances, angles, levels, levels). mask selects the
+    pixels taking part, both of a pair must be selected. Stacks are counted
+    glcmChunk() regions at a time.
+    '''
+    images = np.asarray(image)
+    chunk = glcmChunk(distances, angles, levels)
+    if batched and len(images) > chunk:
+        counts = np.empty((len(images), len(distances), len(angles), levels, levels), np.float32)
+        for start in range(0, len(images), chunk):
+            part = slice(start, start + chunk)
+            counts[part] = graycomatrices(images[part], distances, angles, levels,
+                                          None if mask is None else mask[part], True)
+        return counts
+    if not batched:
+        images = images[None]
+        mask = None if mask is None else np.asarray(mask)[None]
+    if images.size and images.max() >= levels:
+        raise ValueError(f'The image values must be less than {levels} levels')
+    span = levels
+    if mask is not None:
+        # masked pixels get an extra level, whose pairs are dropped after counting
+        span = levels + 1
+        dtype = np.uint8 if span <= 256 else np.uint16
+        images = np.where(mask, images.astype(dtype), dtype(levels))
+    count, height, width = images.shape
+    offsets = glcmOffsets(distances, angles)
+    flat = offsets.reshape(-1, 2)
+    # the counts of an offset are the transposed counts of its opposite (0 and
+    # 180 degrees), and offsets repeat for small distances (0 and 22.5 degrees)
+    flipped = (flat[:, 0] < 0) | ((flat[:, 0] == 0) & (flat[:, 1] < 0))
+    unique, inverse = np.unique(np.where(flipped[:, None], -flat, flat), axis=0, return_inverse=True)
+    bins = count * span * span
+    counts = np.zeros((len(unique), bins), np.float32)
+    # calcHist counts in float32, exact below 2**24 pairs
+    single = count == 1 and images.dtype in (np.uint8, np.uint16) and height * width < 1 << 24
+    if not single:
+        # small codes keep the pair arithmetic and the counting in cache
+        codes = images.astype(np.uint16 if bins <= 1 << 16 else np.int32 if bins < 1 << 31 else np.intp)
+        firsts = (np.arange(count, dtype=codes.dtype)[:, None, None] * span + codes) * span
+    for index, (row, column) in enumerate(unique):
+        top, bottom = max(0, -row), height - max(0, row)
+        left, right = max(0, -column), width - max(0, column)
+        if top >= bottom or left >= right:
+            continue
+        first = (slice(None), slice(top, bottom), slice(left, right))
+        second = (slice(None), slice(top + row, bottom + row), slice(left + column, right + column))
+        if single:
+            # OpenCV counts the pairs of one image straight from the two views
+            counts[index] = cv2.calcHist([images[first][0], images[second][0]], [0, 1], None,
+                                         [span, span], [0, span, 0, span]).ravel()
+        else:
+            counts[index] = np.bincount((firsts[first] + codes[second]).ravel(), minlength=bins)
+    counts = counts.reshape(len(unique), count, span, span)[:, :, :levels, :levels]
+    counts = np.moveaxis(counts, 0, 1)[:, inverse.ravel()]
+    counts[:, flipped] = np.swapaxes(counts[:, flipped], -2, -1)
+    counts = counts.reshape((count,) + offsets.shape[:2] + (levels, levels))
+    return counts if batched else counts[0]
+
+def _entropy(p: np.ndarray, axis=-1) -> np.ndarray:
+    # -sum p ln p, with 0 ln 0 = 0
+    return -np.sum(p * np.log(p, where=p > 0, out=np.zeros_like(p)), axis=axis)
 
-def calcGlcmFor(image, distances, angles):
+def _distribution(normed: np.ndarray, keys: np.ndarray) -> np.ndarray:
+    # sums of the matrix entries (last axis) grouped by keys, one group per key value in order
+    order = np.argsort(keys, kind='stable')
+    starts = np.flatnonzero(np.diff(keys[order], prepend=-1))
+    return np.add.reduceat(normed[..., order], starts, axis=-1, dtype=np.float64)
+
+def glcmProps(counts: np.ndarray, props: tuple=GLCM_PROPS) -> np.ndarray:
+    '''
+    Haralick features of co-occurrence counts (..., levels, levels), an
+    (..., props) array of props out of GLCM_FEATURES, all from one
+    normalization. Names shared with scikit-image's graycoprops() have its
+    definitions. Intermediate sums (marginals, sum and difference
+    distributions, entropy) are only computed when a requested prop needs them.
+    '''
+    unknown = set(props) - set(GLCM_FEATURES)
+    if unknown:
+        raise ValueError(f'Unknown GLCM properties {unknown}, expected some of {GLCM_FEATURES}')
+    props = tuple(props)
+    wanted = set(props)
+    levels = counts.shape[-1]
+    dtype = counts.dtype if counts.dtype.kind == 'f' else np.float64
+    sums = counts.sum(axis=(-2, -1), keepdims=True, dtype=np.float64)
+    normed = (counts / np.maximum(sums, 1).astype(dtype)).reshape(counts.shape[:-2] + (levels * levels,))
+    i, j = np.divmod(np.arange(levels * levels), levels)
+    difference = (i - j).astype(dtype)
+    weights = {
+        'contrast': difference ** 2,
+        'dissimilarity': np.abs(difference),
+        'homogeneity': 1 / (1 + difference ** 2)}
+    values = {}
+    weighted = [prop for prop in props if prop in weights]
+    if weighted:
+        matrix = np.stack([weights[prop] for prop in weighted], axis=-1)
+        for prop, value in zip(weighted, np.moveaxis(normed @ matrix, -1, 0)):
+            values[prop] = value
+    if wanted & {'energy', 'ASM'}:
+        values['ASM'] = np.einsum('...k,...k->...', normed, normed)
+        values['energy'] = np.sqrt(values['ASM'])
+    if 'max probability' in wanted:
+        values['max probability'] = normed.max(axis=-1)
+    if wanted & {'entropy', 'IMC1', 'IMC2'}:
+        values['entropy'] = _entropy(normed)
+
+    grid = np.arange(levels, dtype=np.float64)
+    if wanted & {'mean', 'variance', 'std', 'correlation', 'cluster shade', 'cluster prominence', 'IMC1', 'IMC2'}:
+        matrices = normed.reshape(normed.shape[:-1] + (levels, levels))
+        px = matrices.sum(axis=-1, dtype=np.float64)
+        py = matrices.sum(axis=-2, dtype=np.float64)
+        meanX, meanY = px @ grid, py @ grid
+        values['mean'] = meanX
+        values['variance'] = np.sum(px * (grid - meanX[..., None]) ** 2, axis=-1)
+        values['std'] = np.sqrt(values['variance'])
+        if 'correlation' in wanted:
+            stdY = np.sqrt(np.sum(py * (grid - meanY[..., None]) ** 2, axis=-1))
+            covariance = normed @ (i * j).astype(np.float64) - meanX * meanY
+            scale = values['std'] * stdY
+            degenerate = (values['std'] < 1e-15) | (stdY < 1e-15)
+            values['correlation'] = np.where(degenerate, 1.0, covariance / np.where(degenerate, 1.0, scale))
+        if wanted & {'IMC1', 'IMC2'}:
+            # -sum P ln(px py) and -sum px py ln(px py) both equal HX + HY
+            hx, hy = _entropy(px), _entropy(py)
+            mutual = hx + hy - values['entropy']
+            values['IMC1'] = -mutual / np.where(np.maximum(hx, hy) > 0, np.maximum(hx, hy), 1)
+            values['IMC2'] = np.sqrt(np.maximum(0, 1 - np.exp(-2 * mutual)))
+    else:
+        meanX = meanY = None
+
+    if wanted & {'sum average', 'sum variance', 'sum entropy', 'cluster shade', 'cluster prominence'}:
+        pSum = _distribution(normed, i + j)
+        sumGrid = np.arange(2 * levels - 1, dtype=np.float64)
+        values['sum average'] = pSum @ sumGrid
+        values['sum variance'] = np.sum(pSum * (sumGrid - values['sum average'][..., None]) ** 2, axis=-1)
+        values['sum entropy'] = _entropy(pSum)
+        if meanX is not None:
+            centred = sumGrid - (meanX + meanY)[..., None]
+            values['cluster shade'] = np.sum(pSum * centred ** 3, axis=-1)
+            values['cluster prominence'] = np.sum(pSum * centred ** 4, axis=-1)
+    if wanted & {'difference variance', 'difference entropy'}:
+        pDifference = _distribution(normed, np.abs(i - j))
+        differenceMean = pDifference @ grid
+        values['difference variance'] = np.sum(pDifference * (grid - differenceMean[..., None]) ** 2, axis=-1)
+        values['difference entropy'] = _entropy(pDifference)
+    return np.stack([values[prop] for prop in props], axis=-1).astype(dtype)
+
+def calcGlcmFor(image, distances, angles, props: tuple=GLCM_PROPS, mask=None, batched: bool=False,
+                levels: int=256, quantization: str='uniform') -> np.ndarray:
     '''
-    Calculates GLCM for given arrays of distances and angles.
-    Result: {
+    Calculates GLCM properties for given arrays of distances and angles, over
+    the image quantized to levels grey levels (see quantize()).
+    Result: a float32 (props, distances, angles) array, (N, props, distances,
+    angles) for batched (N, h, w) region stacks; see glcmDict() for a nested
+    dict view. Stacks are reduced to properties glcmChunk() regions at a time,
+    so their co-occurrence matrices are never held all at once.
+    '''
+    image = np.asarray(image)
+    if levels != 256 or image.dtype != np.uint8 or quantization != 'uniform':
+        image = quantize(image, levels, quantization, mask)
+    if not batched:
+        counts = graycomatrices(image, distances, angles, levels, mask)
+        return np.moveaxis(glcmProps(counts, props), -1, -3)
+    chunk = glcmChunk(distances, angles, levels)
+    values = np.empty((len(image), len(props), len(distances), len(angles)), np.float32)
+    for start in range(0, len(image), chunk):
+        part = slice(start, start + chunk)
+        counts = graycomatrices(image[part], distances, angles, levels, None if mask is None else mask[part], True)
+        values[part] = np.moveaxis(glcmProps(counts, props), -1, -3)
+    return values
+
+def glcmDict(values: np.ndarray, distances, angles, props: tuple=GLCM_PROPS) -> dict:
+    '''
+    Nested dict view of a calcGlcmFor() result:
+    {
         'contrast': {
             distance_0: {
                 angle_0: contrast_0_0,
                 angle_1: contrast_0_1,
                 ...
             },
-            distance_1: {
-                angle_0: contrast_1_0,
-                angle_1: contrast_1_1,
-                ...
-            } 
+            ...
         },
         'dissimilarity': { ... },
-        'homogeneity': { ... },
-        'energy': { ... }
+        ...
     }
     '''
-    d_length = len(distances)
-    a_length = len(angles)
-    contrasts = np.zeros((d_length, a_length))
-    dissimilarities = np.zeros((d_length, a_length))
-    homogeneities = np.zeros((d_length, a_length))
-    energies = np.zeros((d_length, a_length))
-
-    result = {}
-    # Calculate GLCM properties
-    result = {
-        'contrast': {},
-        'dissimilarity': {},
-        'homogeneity': {},
-        'energy': {}
-    }
-    npimage = np.array(image)
-    for i, d in enumerate(distances):
-        for key in result.keys():
-            result[key][d] = {}
-        for j, a in enumerate(angles):
-            glcm = feature.graycomatrix(npimage, [d], [a], levels=256)
-
-            for key in result.keys():
-                result[key][d][a] = feature.graycoprops(glcm, key)[0]
-
-            # contrasts[i, j] = feature.graycoprops(glcm, 'contrast')
-            # dissimilarities[i, j] = feature.graycoprops(glcm, 'dissimilarity')
-            # homogeneities[i, j] = feature.graycoprops(glcm, 'homogeneity')
-            # energies[i, j] = feature.graycoprops(glcm, 'energy')
+    return {prop: {distance: {angle: values[p, i, j] for j, angle in enumerate(angles)}
+                   for i, distance in enumerate(distances)}
+            for p, prop in enumerate(props)}
+
+GLCM_MAP_FEATURES = ('contrast', 'dissimilarity', 'homogeneity', 'energy')
+GLCM_MAP_STRIP_ROWS = 512  # shorter strips cost more in per-column overhead than threads win
+
+def _boxSums(values: np.ndarray, rows: tuple, columns: tuple) -> np.ndarray:
+    # sums of values over [y + rows[0], y + rows[1]] x [x + columns[0], x + columns[1]], clipped to the array
+    height, width = values.shape
+    integral = cv2.integral(values.astype(np.float64))
+    y = np.arange(height)[:, None]
+    x = np.arange(width)[None, :]
+    top, bottom = np.clip(y + rows[0], 0, height), np.clip(y + rows[1] + 1, 0, height)
+    left, right = np.clip(x + columns[0], 0, width), np.clip(x + columns[1] + 1, 0, width)
+    return integral[bottom, right] - integral[top, right] - integral[bottom, left] + integral[top, left]
+
+def _stripEnergy(codes: np.ndarray, pad: int, top: int, bottom: int, width: int,
+                 rows: tuple, columns: tuple, bins: int) -> np.ndarray:
+    # sum of the squared co-occurrence counts of the windows of output rows [top, bottom),
+    # slid along the rows: the entering column is counted in, the leaving one out
+    count = bottom - top
+    counts = np.zeros(count * (bins + 1), np.int32)  # per row, bin 'bins' collects invalid pairs
+    squares = np.zeros(count, np.int64)
+    result = np.empty((count, width), np.float64)
+    offsets = (np.arange(count) * (bins + 1))[:, None]
+    invalid = offsets[:, 0] + bins
+    height = rows[1] - rows[0] + 1
+    increments = {1: np.int32(1), -1: np.int32(-1)}  # typed, np.add.at is much faster
+
+    def update(x, sign):
+        values = codes[top + rows[0] + pad:bottom + rows[1] + pad, x + pad]
+        entries = (np.lib.stride_tricks.sliding_window_view(values, height) + offsets).ravel()
+        # adding m pairs to a bin counting n adds 2nm + m^2 to its square, which
+        # is the sum of the bin count before plus after over the m entries
+        # (removing takes it away)
+        before = counts[entries].reshape(count, height).sum(axis=1, dtype=np.int64)
+        np.add.at(counts, entries, increments[sign])
+        counts[invalid] = 0
+        after = counts[entries].reshape(count, height).sum(axis=1, dtype=np.int64)
+        squares[:] += sign * (before + after)
+
+    for x in range(columns[0], columns[1]):
+        update(x, 1)
+    for x in range(width):
+        update(x + columns[1], 1)
+        result[:, x] = squares
+        update(x + columns[0], -1)
     return result
 
+def glcmMaps(image, window: int=15, distance: int=1, angle: float=0, levels: int=32,
+             quantization: str='uniform', features: tuple=('contrast', 'homogeneity', 'energy'),
+             threads: int=None) -> np.ndarray:
+    '''
+    Per-pixel GLCM texture maps: the features (of GLCM_MAP_FEATURES) of the
+    co-occurrence matrix of the window x window neighbourhood of each pixel
+    (clipped at the borders) for one offset, over the image quantized to
+    levels. A float32 (features, h, w) array.
+    Contrast, dissimilarity and homogeneity are averages over the pixel pairs
+    of a window, taken from integral images. Energy needs the counts: they are
+    updated as the window slides, counting the entering column in and the
+    leaving one out. Every strip of rows pays a Python loop over the columns
+    whose small NumPy operations mostly hold the GIL, so the rows are one strip
+    by default; threads splits them into at most that many strips of at least
+    GLCM_MAP_STRIP_ROWS rows, each on its own thread.
+    '''
+    unknown = set(features) - set(GLCM_MAP_FEATURES)
+    if unknown:
+        raise ValueError(f'Unknown GLCM map features {unknown}, expected some of {GLCM_MAP_FEATURES}')
+    codes = quantize(image, levels, quantization).astype(np.int32)
+    height, width = codes.shape
+    row, column = glcmOffsets([distance], [angle])[0, 0]
+    half = window // 2
+    # first pixels of the pairs inside a window, relative to its centre
+    rows = (-half + max(0, -row), half - max(0, row))
+    columns = (-half + max(0, -column), half - max(0, column))
+    # the pair starting at each pixel, the bins code for pairs leaving the image
+    bins = levels * levels
+    pairs = np.full((height, width), bins, np.int32)
+    top, bottom = max(0, -row), height - max(0, row)
+    left, right = max(0, -column), width - max(0, column)
+    pairs[top:bottom, left:right] = (codes[top:bottom, left:right] * levels
+                                     + codes[top+row:bottom+row, left+column:right+column])
+    valid = pairs < bins
+    totals = np.maximum(_boxSums(valid, rows, columns), 1)
+
+    i, j = np.divmod(np.arange(bins + 1), levels)
+    difference = (i - j).astype(np.float64)
+    weights = {
+        'contrast': difference ** 2,
+        'dissimilarity': np.abs(difference),
+        'homogeneity': 1 / (1 + difference ** 2)}
+    maps = {}
+    for feature in features:
+        if feature in weights:
+            table = weights[feature]
+            table[bins] = 0
+            maps[feature] = _boxSums(table[pairs], rows, columns) / totals
+    if 'energy' in features:
+        pad = window
+        padded = np.pad(pairs, pad, constant_values=bins)
+        count = max(1, min(threads or 1, height // GLCM_MAP_STRIP_ROWS))
+        strips = np.linspace(0, height, count + 1).astype(int)
+        with ThreadPoolExecutor(count) as executor:
+            parts = executor.map(lambda strip: _stripEnergy(padded, pad, strip[0], strip[1], width,
+                                                            rows, columns, bins),
+                                 zip(strips[:-1], strips[1:]))
+            maps['energy'] = np.sqrt(np.concatenate(list(parts))) / totals
+    return np.stack([maps[feature] for feature in features]).astype(np.float32)
+
 class GlcmFilter(f.Filter):
-    def __init__(self) -> None:
+    '''
+    GLCM features of images or region stacks, by default every one of
+    GLCM_FEATURES so viewers can switch between them; pass props to only pay
+    for some.
+    '''
+    WORKLOAD = f.Workload.CPU
+
+    def __init__(self, distancesCount: int=5, anglesCount: int=None, anglesStep: float=45,
+                 levels: int=256, quantization: str='uniform', props: tuple=GLCM_FEATURES) -> None:
         super().__init__('GLCM')
-        self._inputs.append(f.InputPin(self, 0))
+        unknown = set(props) - set(GLCM_FEATURES)
+        if unknown:
+            raise ValueError(f'Unknown GLCM properties {unknown}, expected some of {GLCM_FEATURES}')
+        self._inputs.append(f.InputPin(self, 0, formats=('L',)))
         self._outputs.append(f.OutputPin(self, 0))
+        self._distancesCount = distancesCount
+        self._anglesCount = anglesCount
+        self._anglesStep = anglesStep
+        self._levels = levels
+        self._quantization = quantization
+        self._props = tuple(props)
+
+    def props(self) -> tuple:
+        return self._props
+
+    def params(self) -> tuple:
+        return (self._distancesCount, self._anglesCount, self._anglesStep, self._levels, self._quantization,
+                self._props)
 
     def exec(self, inputPin: f.InputPin, frame: f.Frame):
+        '''
+        Pushes the calcGlcmFor() array, (N, props, distances, angles) for region
+        stacks, with its 'props', 'distances' and 'angles' axes as meta.
+        '''
         super().exec(inputPin, frame)
         image = frame.value()
-        glcm = calcGlcm(image)
-        self.pushOne(f.Frame(glcm, self, inputPin))
+        meta = frame.meta()
+        distances, angles = glcmAxes(self._distancesCount, self._anglesCount, self._anglesStep)
+        batched = 'regions' in meta
+        glcm = self.compute(calcGlcmFor, image, distances, angles, self._props, meta.get('mask'), batched,
+                            self._levels, self._quantization)
+        axes = {'props': self._props, 'distances': distances, 'angles': angles, 'levels': self._levels}
+        if batched:
+            axes.update(regions=meta['regions'], path=meta.get('path'))
+        self.pushOne(f.Frame(glcm, self, inputPin, meta=axes))
+
+
+class GlcmMapFilter(f.Filter):
+    '''
+    Sliding window GLCM texture maps, see glcmMaps(): one float32 image per
+    feature, each on its own output pin in the order of features.
+    '''
+    WORKLOAD = f.Workload.CPU
+
+    def __init__(self, window: int=15, distance: int=1, angle: float=0, levels: int=32,
+                 quantization: str='uniform', features: tuple=('contrast', 'homogeneity', 'energy'),
+                 threads: int=None) -> None:
+        super().__init__('GLCM Maps')
+        unknown = set(features) - set(GLCM_MAP_FEATURES)
+        if unknown:
+            raise ValueError(f'Unknown GLCM map features {unknown}, expected some of {GLCM_MAP_FEATURES}')
+        self._inputs.append(f.InputPin(self, 0, formats=('L',)))
+        for index in range(len(features)):
+            self._outputs.append(f.OutputPin(self, index, format='F'))
+        self._window = window
+        self._distance = distance
+        self._angle = angle
+        self._levels = levels
+        self._quantization = quantization
+        self._features = tuple(features)
+        self._threads = threads
+
+    def features(self) -> tuple:
+        return self._features
+
+    def params(self) -> tuple:
+        return (self._window, self._distance, self._angle, self._levels, self._quantization, self._features)
+
+    def exec(self, inputPin: f.InputPin, frame: f.Frame):
+        super().exec(inputPin, frame)
+        maps = self.compute(glcmMaps, frame.value(), self._window, self._distance, self._angle, self._levels,
+                            self._quantization, self._features, self._threads)
+        self.pushMany([f.Frame(value, self, inputPin, meta=frame.meta()) for value in maps])
@@ -0,0 +1,155 @@
+import hashlib
+import os
+import pickle
+import sys
+import threading
+from collections import OrderedDict
+import numpy as np
+from log import ConsoleLog as log
+
+
+def _update(hasher, value):
+    if isinstance(value, np.ndarray):
+        hasher.update(f'nd{value.dtype.str}{value.shape}'.encode())
+        hasher.update(np.ascontiguousarray(value).data)
+    elif hasattr(value, 'mode') and hasattr(value, 'tobytes'):  # PIL image
+        hasher.update(f'im{value.mode}{value.size}'.encode())
+        hasher.update(value.tobytes())
+    elif isinstance(value, (bytes, bytearray, memoryview)):
+        hasher.update(b'b')
+        hasher.update(value)
+    elif isinstance(value, (list, tuple)):
+        hasher.update(f'{type(value).__name__}{len(value)}'.encode())
+        for item in value:
+            _update(hasher, item)
+    elif isinstance(value, dict):
+        hasher.update(f'dict{len(value)}'.encode())
+        for key in sorted(value, key=repr):
+            _update(hasher, key)
+            _update(hasher, value[key])
+    else:
+        hasher.update(f'{type(value).__name__}:{value!r}'.encode())
+
+def digest(*parts) -> str:
+    '''Content hash of values (arrays, images, containers and scalars).'''
+    hasher = hashlib.blake2b(digest_size=20)
+    for part in parts:
+        _update(hasher, part)
+    return hasher.hexdigest()
+
+def sizeOf(value) -> int:
+    '''Approximate number of bytes held by a value.'''
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if hasattr(value, 'mode') and hasattr(value, 'getbands'):  # PIL image
+        return value.width * value.height * len(value.getbands())
+    if isinstance(value, (list, tuple)):
+        return sys.getsizeof(value) + sum(sizeOf(item) for item in value)
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(sizeOf(k) + sizeOf(v) for k, v in value.items())
+    return sys.getsizeof(value)
+
+
+class MemoryCache:
+    '''Least recently used cache bounded by the approximate size of its values.'''
+    def __init__(self, maxBytes: int) -> None:
+        self._maxBytes = maxBytes
+        self._bytes = 0
+        self._entries = OrderedDict()  # key -> (value, size)
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return default
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def put(self, key, value) -> None:
+        size = sizeOf(value)
+        if size > self._maxBytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1]
+            self._entries[key] = (value, size)
+            self._bytes += size
+            while self._bytes > self._maxBytes:
+                _, (_, evictedSize) = self._entries.popitem(last=False)
+                self._bytes -= evictedSize
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def bytes(self) -> int:
+        return self._bytes
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class DiskCache:
+    '''Pickles values into files named by their key under a directory.'''
+    def __init__(self, directory: str) -> None:
+        self._directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key) -> str:
+        return os.path.join(self._directory, key[:2], f'{key}.pkl')
+
+    def get(self, key, default=None):
+        path = self._path(key)
+        if not os.path.exists(path):
+            return default
+        try:
+            with open(path, 'rb') as file:
+                return pickle.load(file)
+        except Exception as e:
+            log.warn(f'Cannot read cache entry {path}: {e}')
+            return default
+
+    def put(self, key, value) -> None:
+        path = self._path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path + '.tmp', 'wb') as file:
+                pickle.dump(value, file, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(path + '.tmp', path)
+        except Exception as e:
+            log.warn(f'Cannot write cache entry {path}: {e}')
+
+
+class ResultCache:
+    '''
+    Filter result cache: an in-memory LRU tier bounded by bytes and an
+    optional on-disk tier. Entries found on disk are promoted to memory.
+    '''
+    def __init__(self, maxBytes: int=512*1024*1024, directory: str=None) -> None:
+        self._memory = MemoryCache(maxBytes)
+        self._disk = DiskCache(directory) if directory else None
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        value = self._memory.get(key)
+        if value is None and self._disk is not None:
+            value = self._disk.get(key)
+            if value is not None:
+                self._memory.put(key, value)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def put(self, key, value) -> None:
+        self._memory.put(key, value)
+        if self._disk is not None:
+            self._disk.put(key, value)
+
+    def clear(self) -> None:
+        self._memory.clear()
@@ -1,5 +1,17 @@
+import enum
+import heapq
+import itertools
+import os
+import threading
+import time
+import traceback
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
+import numpy as np
+from PIL import Image
 from log import ConsoleLog as log
-from PyQt6.QtCore import pyqtSignal, QObject
+from filter_cache import digest
+from profiling import Profiler, timedCall
 # class IOutputPin:
 #     def __init__(self) -> None:
 #         pass
@@ -27,81 +39,302 @@ from PyQt6.QtCore import pyqtSignal, QObject
 #     def connect(self, output: IOutputPin):
 #         pass
 
+class Cancelled(Exception):
+    '''Raised by Pipeline.exec() when a run is abandoned through its cancel event.'''
+    pass
+
+
+class Signal:
+    '''
+    Minimal observer: callbacks run synchronously in the emitting thread.
+    UI code must bridge to its own thread (see pipeline_widget.QtFilterAdapter).
+    Callbacks are not pickled with their owner.
+    '''
+    def __init__(self) -> None:
+        self._callbacks = []
+
+    def connect(self, callback) -> None:
+        self._callbacks = self._callbacks + [callback]
+
+    def disconnect(self, callback=None) -> None:
+        if callback is None:
+            self._callbacks = []
+        else:
+            self._callbacks = [c for c in self._callbacks if c != callback]
+
+    def emit(self, *args) -> None:
+        for callback in self._callbacks:
+            callback(*args)
+
+    def __getstate__(self):
+        return {'_callbacks': []}
+
+
+class Workload(enum.Enum):
+    LIGHT = 0  # cheap, runs wherever it is scheduled
+    IO = 1  # waits on disk or network, threads are enough
+    CPU = 2  # heavy compute, may be moved to a process pool
+
+# PIL modes that map 1:1 onto an ndarray dtype/shape
+ARRAY_MODES = {
+    'L': (np.uint8, 1), 'LA': (np.uint8, 2), 'RGB': (np.uint8, 3), 'RGBA': (np.uint8, 4),
+    '1': (np.bool_, 1), 'I;16': (np.uint16, 1), 'I': (np.int32, 1), 'F': (np.float32, 1)}
+
+def arrayMode(array: np.ndarray) -> str:
+    '''PIL mode matching an image array, None when there is none.'''
+    channels = 1 if array.ndim == 2 else array.shape[-1] if array.ndim == 3 else None
+    for mode, (dtype, modeChannels) in ARRAY_MODES.items():
+        if array.dtype == dtype and channels == modeChannels:
+            return mode
+    return None
+
+def imageToArray(image) -> np.ndarray:
+    '''Decodes a PIL image into an ndarray, converting modes without an array equivalent.'''
+    if image.mode not in ARRAY_MODES:
+        hasAlpha = 'A' in image.getbands() or 'transparency' in image.info
+        image = image.convert('RGBA' if hasAlpha else 'RGB')
+    return np.asarray(image)
+
+
 class Frame:
-    def __init__(self, value, fromFilter, fromPin) -> None:
+    '''
+    A value travelling between filters. A frame is shared by every input pin
+    it is pushed to, so ndarray values are stored as read-only views:
+    consumers must not (and cannot) modify them in place.
+    Images are carried as ndarrays (PIL images are converted on construction);
+    PIL and QImage views are only created when a consumer asks for them.
+    '''
+    def __init__(self, value, fromFilter, fromPin, key: str=None, meta: dict=None) -> None:
+        image = None
+        if isinstance(value, Image.Image):
+            image = value
+            value = imageToArray(value)
+        if isinstance(value, np.ndarray) and value.flags.writeable:
+            value = value.view()
+            value.flags.writeable = False
         self._value = value
+        self._image = image if image is not None and image.mode in ARRAY_MODES else None
         self._fromFilter = fromFilter
         self._fromPin = fromPin
+        self._key = key
+        self._meta = {} if meta is None else meta
 
     def value(self):
         return self._value
-    
+
+    def array(self) -> np.ndarray:
+        return self._value
+
+    def isImage(self) -> bool:
+        return isinstance(self._value, np.ndarray) and arrayMode(self._value) is not None
+
+    def dtype(self):
+        return self._value.dtype
+
+    def shape(self) -> tuple:
+        return self._value.shape
+
+    def mode(self) -> str:
+        return arrayMode(self._value)
+
+    def image(self) -> Image.Image:
+        '''PIL view of an image frame, created on first use.'''
+        if self._image is None:
+            self._image = Image.fromarray(self._value)
+        return self._image
+
+    def qimage(self):
+        '''QImage view of an image frame, created on demand.'''
+        from PIL import ImageQt
+        return ImageQt.ImageQt(self.image())
+
+    def meta(self) -> dict:
+        '''
+        Side information that travels with the value, e.g. 'roi': the
+        (left, top, fullWidth, fullHeight) placement of a region cropped
+        early by image_filters.RoiCrop, or 'path': the image file a frame
+        comes from. Treat as read-only.
+        '''
+        return self._meta
+
     def fromFilter(self):
         return self._fromFilter
     
     def fromPin(self):
         return self._fromPin
 
+    def key(self) -> str:
+        '''
+        Content address of the value. Filters with a cache derive it from their
+        own cache key, otherwise it is computed (once) by hashing the value.
+        '''
+        if self._key is None:
+            self._key = digest(self._value)
+        return self._key
+
+    def setKey(self, key: str) -> None:
+        self._key = key
+
 
 class OutputPin:
-    def __init__(self, parent=None, id=None, inputPin=None) -> None:
+    '''
+    Sends frames to any number of connected input pins; all of them receive the same frame.
+    format is the ARRAY_MODES mode of the frames, if known before execution.
+    '''
+    def __init__(self, parent=None, id=None, inputPin=None, format: str=None) -> None:
         self._parent = parent
-        self._inputPin = inputPin
+        self._inputPins = [] if inputPin is None else [inputPin]
         self._id = '-' if id is None else id
+        self._format = format
+        self._executor = None
 
     def push(self, frame:Frame):
-        if(self._inputPin is None):
+        if self._executor is not None:
+            self._executor.send(self, frame)
+        elif not self._inputPins:
             log.error(f'Output pin {self._parent.name()}:{self._id} is not connected')
         else:
-            self._inputPin.receive(frame)
+            for inputPin in self._inputPins:
+                inputPin.receive(frame)
 
     def connect(self, inputPin):
         if inputPin.canReceive(self):
-            self._inputPin = inputPin
+            if inputPin not in self._inputPins:
+                self._inputPins.append(inputPin)
         else:
             log.error(f'Output pin cannot receive input from {self._parent.name()} filter')
 
+    def disconnect(self, inputPin) -> None:
+        if inputPin in self._inputPins:
+            self._inputPins.remove(inputPin)
+
+    def inputPin(self):
+        return self._inputPins[0] if self._inputPins else None
+
+    def inputPins(self) -> list:
+        return list(self._inputPins)
+
+    def isConnected(self) -> bool:
+        return len(self._inputPins) > 0
+
+    def format(self) -> str:
+        return self._format
+
+    def setFormat(self, format: str) -> None:
+        self._format = format
+
+    def parent(self):
+        return self._parent
+
+    def id(self):
+        return self._id
+
+    def executor(self):
+        return self._executor
+
+    def setExecutor(self, executor) -> None:
+        self._executor = executor
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_executor'] = None
+        return state
+
 
 class InputPin:
-    def __init__(self, parent, id=None) -> None:
+    '''
+    Receives frames for its filter. formats lists the ARRAY_MODES modes the
+    filter can process (e.g. ('L',)), None for any value; graph passes such as
+    image_filters.negotiateFormats() insert the conversions the others need.
+    '''
+    def __init__(self, parent, id=None, formats: tuple=None) -> None:
         self._parent = parent
         self._id = '-' if id is None else id
+        self._formats = formats
 
     def receive(self, frame):
-        self._parent.exec(self, frame)
+        self._parent.process(self, frame)
 
     def canReceive(self, outputPin) -> bool:
         return True
+
+    def formats(self) -> tuple:
+        return self._formats
+
+    def accepts(self, format: str) -> bool:
+        '''Whether frames of format (None: unknown) surely need no conversion.'''
+        return self._formats is None or format in self._formats
     
     def id(self):
         return self._id
 
+    def parent(self):
+        return self._parent
+
 class Source:
     def __init__(self) -> None:
         self._data = None
-        self._output = OutputPin(0)
+        self._output = OutputPin(self, 0)
+
+    def name(self):
+        return 'Source'
 
-    def exec(self, data=None):
+    def setData(self, data) -> None:
+        '''data is any iterable, e.g. a list of paths or a generator like image_files.walkImages().'''
+        self._data = data
+
+    def exec(self, data=None, cancel: threading.Event=None):
+        executor = self._output.executor()
+        if executor is not None:
+            return list(self.stream(data, cancel))
+        for item in self._items(data):
+            self._output.push(Frame(item, self, None))
+
+    def stream(self, data=None, cancel: threading.Event=None):
+        '''
+        Lazily pulls one item at a time from data and yields the outputs of each
+        item as soon as it went through the graph, see GraphExecutor.stream().
+        '''
+        executor = self._output.executor()
+        if executor is None:
+            raise RuntimeError('Source is not bound to an executor')
+        return executor.stream(self._items(data), cancel)
+
+    def _items(self, data):
         if data is None:
             data = self._data
         if data is None:
             log.error('Source has no data')
-        for item in data:
-            self._output.push(Frame(item, self, None))
+            return ()
+        return data
 
     def output(self):
         return self._output
 
+    def outputs(self) -> list[OutputPin]:
+        return [self._output]
+
 
 class Renderer:
 
     def __init__(self, name: str=None) -> None:
         self._name = name
         self._inputs = [InputPin(self, 0)]
+        self._dirty = True
+        self._lastInputs = {}
 
     def name(self):
         return self._name
 
+    def isDirty(self) -> bool:
+        return self._dirty
+
+    def invalidate(self) -> None:
+        self._dirty = True
+
+    def lastInputs(self) -> dict:
+        return dict(self._lastInputs)
+
     def inputs(self) -> list[InputPin]:
         return self._inputs
 
@@ -109,26 +342,184 @@ class Renderer:
         input = self._inputs[0]
         return input
 
+    def process(self, inputPin: InputPin, frame: Frame) -> None:
+        self._lastInputs[inputPin] = frame
+        self.exec(inputPin, frame)
+        self._dirty = False
+
     def exec(self, inputPin: InputPin, frame: Frame) -> None:
         self.render(frame)
     
     def render(self, frame: Frame) -> None:
         pass
 
+    def outputs(self) -> list[OutputPin]:
+        return []
+
 
-class Filter(QObject):
-    filter_executing = pyqtSignal(object, Frame)  # filter, frame
-    filter_executed = pyqtSignal(object, Frame)  # filter, frame
+class Filter:
+    WORKLOAD = Workload.LIGHT
+    # ROI transparent filters compute each output pixel from a bounded input
+    # neighbourhood (see outputSize/mapRectToInput), so a downstream crop can
+    # be moved ahead of them, see image_filters.optimizeCrops()
+    ROI = False
+    # reentrant filters keep no state between executions, so the parallel
+    # executor may run them on several frames (e.g. tiles) at the same time
+    REENTRANT = False
 
     def __init__(self, name: str) -> None:
-        super().__init__()
+        self.filter_executing = Signal()  # filter, frame
+        self.filter_executed = Signal()  # filter, frame
         self._name = name
         self._inputs = []
         self._outputs = []
         self._renderer = None
+        self._executor = None
+        self._cache = None
+        self._call = threading.local()  # cacheKey, recording of the running execution
+        self._dirty = True
+        self._retain = True
+        self._lastInputs = {}
+        self._dependents = []  # upstream filters reading this filter's parameters
 
     def name(self):
         return self._name
+
+    def isDirty(self) -> bool:
+        return self._dirty
+
+    def invalidate(self) -> None:
+        '''
+        Marks the filter and everything downstream of it as needing to run again,
+        call it whenever a parameter changes. See Pipeline.update(). The filters
+        added with addDependent() are invalidated as well.
+        '''
+        for dependent in self._dependents:
+            dependent.invalidate()
+        self._invalidateDownstream()
+
+    def _invalidateDownstream(self) -> None:
+        # a change upstream does not change the parameters dependents read
+        self._dirty = True
+        for outputPin in self._outputs:
+            for inputPin in outputPin.inputPins():
+                consumer = inputPin.parent()
+                getattr(consumer, '_invalidateDownstream', consumer.invalidate)()
+
+    def addDependent(self, filter) -> None:
+        '''
+        Invalidates filter along with this one whenever this filter's parameters
+        change, for filters upstream whose output depends on them (e.g. a
+        RoiCrop cropping for a resize, see image_filters.optimizeCrops()).
+        '''
+        if filter not in self._dependents:
+            self._dependents.append(filter)
+
+    def removeDependent(self, filter) -> None:
+        if filter in self._dependents:
+            self._dependents.remove(filter)
+
+    def setRetain(self, retain: bool) -> None:
+        '''Keep the last frame received on each input pin for re-execution.'''
+        self._retain = retain
+        if not retain:
+            self._lastInputs = {}
+
+    def lastInputs(self) -> dict:
+        return dict(self._lastInputs)
+
+    def __getstate__(self):
+        # executor, cache and in-flight state stay with the process that owns them
+        state = self.__dict__.copy()
+        state.update(_executor=None, _cache=None, _lastInputs={})
+        del state['_call']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._call = threading.local()
+
+    def params(self) -> tuple:
+        '''Parameters affecting the output, part of the cache key.'''
+        return ()
+
+    def setCache(self, cache) -> None:
+        self._cache = cache
+
+    def margin(self) -> int:
+        '''Radius of the input neighbourhood each output pixel depends on.'''
+        return 0
+
+    def outputSize(self, size: tuple) -> tuple:
+        '''(width, height) of the output for an input of the given size.'''
+        return size
+
+    def mapRectToInput(self, rect: tuple, inputSize: tuple, outputSize: tuple) -> tuple:
+        '''Input (left, top, right, bottom) needed to produce the output rect.'''
+        m = self.margin()
+        return (rect[0]-m, rect[1]-m, rect[2]+m, rect[3]+m)
+
+    def inputGrid(self, inputSize: tuple, outputSize: tuple, dtype=np.uint8) -> tuple:
+        '''(x, y) multiples an input region must start at to be processed like the full input.'''
+        return (1, 1)
+
+    def cacheKey(self, inputPin: InputPin, frame: Frame) -> str:
+        '''Key of the outputs for a frame, None for filters that must always execute.'''
+        return digest(type(self).__name__, inputPin.id(), self.params(), frame.key(), frame.meta())
+
+    def process(self, inputPin: InputPin, frame: Frame) -> None:
+        '''
+        Executes the filter for a frame, or replays the cached outputs of an
+        identical (same input content, same parameters) earlier execution.
+        '''
+        if self._retain:
+            self._lastInputs[inputPin] = frame
+        self._process(inputPin, frame)
+        self._dirty = False
+
+    def _process(self, inputPin: InputPin, frame: Frame) -> None:
+        key = None if self._cache is None else self.cacheKey(inputPin, frame)
+        if key is None:
+            self.exec(inputPin, frame)
+            return
+        recorded = self._cache.get(key)
+        call = self._call
+        call.cacheKey = key
+        try:
+            if recorded is not None:
+                self.filter_executing.emit(self, frame)
+                for many, values in recorded:
+                    if many:
+                        self.pushMany([Frame(value, self, inputPin, meta=meta) for value, meta in values])
+                    else:
+                        self.pushOne(Frame(values[0], self, inputPin, meta=values[1]))
+                return
+            call.recording = []
+            self.exec(inputPin, frame)
+            self._cache.put(key, call.recording)
+        finally:
+            call.recording = None
+            call.cacheKey = None
+
+    def _outputKey(self, frame: Frame, index: int) -> None:
+        key = getattr(self._call, 'cacheKey', None)
+        if key is not None:
+            frame.setKey(digest(key, index))
+
+    def workload(self) -> Workload:
+        return self.WORKLOAD
+
+    def setExecutor(self, executor) -> None:
+        self._executor = executor
+
+    def compute(self, fn, *args):
+        '''
+        Runs fn(*args) for this filter. CPU-bound filters may have it executed
+        in a worker process, so fn and args must be picklable.
+        '''
+        if self._executor is None:
+            return fn(*args)
+        return self._executor.compute(self, fn, *args)
     
     def exec(self, inputPin: InputPin, frame:Frame) -> None:
         self.filter_executing.emit(self, frame)
@@ -142,6 +533,11 @@ class Filter(QObject):
     #         log.error(f'Filter {self.name()} has no pin {pinIndex}')
 
     def pushMany(self, outputFrames):
+        recording = getattr(self._call, 'recording', None)
+        if recording is not None:
+            recording.append((True, [(frame.value(), frame.meta()) for frame in outputFrames]))
+        for index, outputFrame in enumerate(outputFrames):
+            self._outputKey(outputFrame, index)
         length = len(outputFrames)
         index = 0
         for outputPin in self._outputs:
@@ -154,6 +550,10 @@ class Filter(QObject):
             index += 1
         
     def pushOne(self, outputFrame):
+        recording = getattr(self._call, 'recording', None)
+        if recording is not None:
+            recording.append((False, (outputFrame.value(), outputFrame.meta())))
+        self._outputKey(outputFrame, 0)
         self.filter_executed.emit(self, outputFrame)
         if len(self._outputs):
             for outputPin in self._outputs:
@@ -181,12 +581,510 @@ class Filter(QObject):
         self._outputs.append(outputPin)
 
 
+class GraphExecutor:
+    '''
+    Runs a filter graph in topological order instead of recursing through pins.
+    The order is computed once from the source; output pins are bound to the
+    executor so that pushes only queue frames on the receiving input pins.
+    A node runs when every one of its connected input pins holds a frame.
+    Frames pushed to unconnected output pins are the results of a run.
+    A filter pushing many frames per input (e.g. tiles) is throttled: once an
+    input pin holds MAX_PENDING frames its consumers run before the push returns,
+    so memory is bounded by a few frames instead of everything produced.
+    '''
+    MAX_PENDING = 4
+
+    def __init__(self, source: Source) -> None:
+        self._source = source
+        self._nodes = []
+        self._rank = {}
+        self._inputs = {}
+        self._pending = {}
+        self._ready = []
+        self._queued = set()
+        self._running = {}  # node -> number of executions in progress
+        self._sequence = 0
+        self._outputs = {}
+        self._profiler = None
+        self._cancel = None
+        self._compile()
+
+    def nodes(self) -> list:
+        return list(self._nodes)
+
+    def _compile(self):
+        edges = {}
+        indegree = {}
+        inputs = {}
+        stack = [self._source]
+        while stack:
+            node = stack.pop()
+            if node in edges:
+                continue
+            edges[node] = []
+            indegree.setdefault(node, 0)
+            if isinstance(node, Filter):
+                node.setExecutor(self)
+            for outputPin in node.outputs():
+                outputPin.setExecutor(self)
+                for inputPin in outputPin.inputPins():
+                    child = inputPin.parent()
+                    edges[node].append(child)
+                    indegree[child] = indegree.get(child, 0) + 1
+                    inputs.setdefault(child, [])
+                    if inputPin not in inputs[child]:
+                        inputs[child].append(inputPin)
+                    stack.append(child)
+
+        # Kahn's algorithm; ranks give the ready queue a stable topological order
+        order = []
+        ready = [node for node in edges if indegree[node] == 0]
+        while ready:
+            node = ready.pop(0)
+            order.append(node)
+            for child in edges[node]:
+                indegree[child] -= 1
+                if indegree[child] == 0:
+                    ready.append(child)
+        if len(order) != len(edges):
+            raise ValueError('Filter graph contains a cycle')
+
+        self._nodes = order
+        self._parents = {node: [] for node in order}
+        for node, children in edges.items():
+            for child in children:
+                self._parents[child].append(node)
+        self._rank = {node: rank for rank, node in enumerate(order)}
+        self._inputs = inputs
+        self._pending = {inputPin: deque() for pins in inputs.values() for inputPin in pins}
+
+    def setProfiler(self, profiler) -> None:
+        self._profiler = profiler
+
+    def send(self, outputPin: OutputPin, frame: Frame) -> None:
+        if self._profiler is not None:
+            self._profiler.recordOutput(outputPin.parent().name(), outputPin.id(), frame.value())
+        inputPins = outputPin.inputPins()
+        if not inputPins:
+            self.collect(outputPin, frame)
+        for inputPin in inputPins:
+            self.schedule(inputPin, frame)
+
+    def schedule(self, inputPin: InputPin, frame: Frame) -> None:
+        queue = self._pending.get(inputPin)
+        if queue is None:
+            log.error(f'Input pin {inputPin.parent().name()}:{inputPin.id()} is not part of the graph')
+            return
+        queue.append(frame)
+        self._enqueue(inputPin.parent())
+        if len(queue) > self.MAX_PENDING:
+            self._throttle(inputPin)
+
+    def _throttle(self, inputPin: InputPin) -> None:
+        # called from within the producing filter, run the consumers now
+        queue = self._pending[inputPin]
+        while len(queue) > self.MAX_PENDING and self._ready:
+            self._step()
+
+    def compute(self, filter, fn, *args):
+        return fn(*args)
+
+    def collect(self, outputPin: OutputPin, frame: Frame) -> None:
+        self._outputs[f'{outputPin.parent().name()}:{outputPin.id()}'] = frame.value()
+
+    def _isReady(self, node) -> bool:
+        if node in self._running and not getattr(node, 'REENTRANT', False):
+            return False
+        return all(self._pending[inputPin] for inputPin in self._inputs[node])
+
+    def _enqueue(self, node) -> None:
+        if node not in self._queued and self._isReady(node):
+            self._queued.add(node)
+            self._sequence += 1
+            heapq.heappush(self._ready, (self._rank[node], self._sequence, node))
+
+    def _popReady(self):
+        _, _, node = heapq.heappop(self._ready)
+        self._queued.discard(node)
+        frames = [(inputPin, self._pending[inputPin].popleft()) for inputPin in self._inputs[node]]
+        self._running[node] = self._running.get(node, 0) + 1
+        return node, frames
+
+    def _done(self, node) -> None:
+        count = self._running.pop(node) - 1
+        if count:
+            self._running[node] = count
+
+    def _runNode(self, node, frames) -> None:
+        profiler = self._profiler
+        for inputPin, frame in frames:
+            if profiler is None:
+                inputPin.receive(frame)
+                continue
+            bytesIn = profiler.recordInput(node.name(), inputPin.id(), frame.value())
+            wallStart = time.perf_counter()
+            cpuStart = time.thread_time()
+            inputPin.receive(frame)
+            profiler.recordFilter(node.name(), time.perf_counter() - wallStart,
+                                  time.thread_time() - cpuStart, bytesIn)
+
+    def _cancelled(self) -> bool:
+        return self._cancel is not None and self._cancel.is_set()
+
+    def _step(self) -> None:
+        if self._cancelled():
+            raise Cancelled()
+        node, frames = self._popReady()
+        try:
+            self._runNode(node, frames)
+        finally:
+            self._done(node)
+        self._enqueue(node)
+
+    def _run(self) -> None:
+        while self._ready:
+            self._step()
+
+    def _clear(self) -> None:
+        for queue in self._pending.values():
+            queue.clear()
+        self._ready = []
+        self._queued = set()
+        self._running = {}
+        self._outputs = {}
+
+    def exec(self, data, cancel: threading.Event=None) -> list[dict]:
+        '''
+        Pushes each item through the graph.
+        Returns one dict per item mapping 'filter:pin' of unconnected outputs to values.
+        Setting cancel abandons the run between two filters, raising Cancelled.
+        '''
+        return list(self.stream(data, cancel))
+
+    def stream(self, data, cancel: threading.Event=None):
+        '''
+        Generator version of exec(): data may be any iterable and is consumed
+        lazily, the outputs of an item are yielded before the next item is pulled.
+        Only one item is in flight, so memory stays flat however long data is.
+        '''
+        for item in data:
+            yield self._execItem(item, cancel)
+
+    def _execItem(self, item, cancel: threading.Event=None) -> dict:
+        self._cancel = cancel
+        try:
+            self._source.output().push(Frame(item, self._source, None))
+            self._run()
+            outputs = self._outputs
+            self._outputs = {}
+            return outputs
+        except Exception:
+            self._clear()
+            raise
+        finally:
+            self._cancel = None
+
+    def update(self, cancel: threading.Event=None) -> dict:
+        '''
+        Re-runs only dirty nodes. Each dirty node whose parents are all clean is
+        fed the frames it retained from the previous run; its (dirty) descendants
+        run as usual. Returns the outputs of the re-run, like one item of exec().
+        '''
+        self._cancel = cancel
+        try:
+            for node in self._nodes:
+                if not self._isDirty(node) or any(self._isDirty(parent) for parent in self._parents[node]):
+                    continue
+                frames = node.lastInputs()
+                if len(frames) < len(self._inputs[node]):
+                    log.warn(f'{node.name()} has no retained input, run the pipeline first')
+                    continue
+                for inputPin in self._inputs[node]:
+                    self.schedule(inputPin, frames[inputPin])
+            self._run()
+            outputs = self._outputs
+            self._outputs = {}
+            return outputs
+        except Exception:
+            self._clear()
+            raise
+        finally:
+            self._cancel = None
+
+    def _isDirty(self, node) -> bool:
+        return getattr(node, 'isDirty', None) is not None and node.isDirty()
+
+    def shutdown(self) -> None:
+        pass
+
+
+class ParallelExecutor(GraphExecutor):
+    '''
+    Runs ready nodes concurrently on a thread pool, so independent branches
+    (e.g. Histogram and GLCM after a crop) no longer wait on each other.
+    A node runs concurrently with itself only when it is REENTRANT. A producer
+    held back by a full input queue runs its consumer inline when no worker is
+    free to take it. Work a CPU-bound filter passes to Filter.compute() goes to
+    the process pool when one is configured.
+    '''
+    def __init__(self, source: Source, threads: int=None, processes: int=0) -> None:
+        self._threads = ThreadPoolExecutor(threads, thread_name_prefix='pipeline')
+        self._processes = ProcessPoolExecutor(processes) if processes else None
+        self._maxThreads = self._threads._max_workers
+        self._condition = threading.Condition()
+        self._submitted = {}  # node -> frames handed to the pool but not yet started
+        self._executing = 0
+        self._error = None
+        super().__init__(source)
+
+    def schedule(self, inputPin: InputPin, frame: Frame) -> None:
+        with self._condition:
+            super().schedule(inputPin, frame)
+            self._condition.notify_all()
+
+    def _throttle(self, inputPin: InputPin) -> None:
+        # block the producing thread while its consumer is certain to make progress
+        queue = self._pending[inputPin]
+        consumer = inputPin.parent()
+        self._condition.notify_all()
+        while len(queue) > self.MAX_PENDING and self._error is None:
+            if self._submitted.get(consumer) and self._executing >= self._maxThreads:
+                # every worker is busy, this one included: run the consumer here
+                self._execute(consumer, self._submitted[consumer].popleft())
+            elif consumer in self._running or consumer in self._queued:
+                self._condition.wait()
+            else:
+                break
+
+    def collect(self, outputPin: OutputPin, frame: Frame) -> None:
+        with self._condition:
+            super().collect(outputPin, frame)
+
+    def compute(self, filter, fn, *args):
+        if self._processes is not None and filter.workload() == Workload.CPU:
+            if self._profiler is None:
+                return self._processes.submit(fn, *args).result()
+            result, cpuTime = self._processes.submit(timedCall, fn, *args).result()
+            self._profiler.recordCpu(filter.name(), cpuTime)
+            return result
+        return fn(*args)
+
+    def _execute(self, node, frames) -> None:
+        # called with the condition held, releases it while the node runs
+        self._executing += 1
+        self._condition.release()
+        error = None
+        try:
+            self._runNode(node, frames)
+        except BaseException as e:
+            error = e
+        finally:
+            self._condition.acquire()
+            self._executing -= 1
+        self._done(node)
+        if error is not None and self._error is None:
+            self._error = error
+        self._enqueue(node)
+        self._condition.notify_all()
+
+    def _work(self, node) -> None:
+        with self._condition:
+            if self._submitted[node]:  # empty when a throttled producer ran it inline
+                self._execute(node, self._submitted[node].popleft())
+
+    def _run(self) -> None:
+        with self._condition:
+            while True:
+                if self._cancelled() and self._error is None:
+                    self._error = Cancelled()
+                while self._ready and self._error is None:
+                    node, frames = self._popReady()
+                    self._enqueue(node)  # reentrant nodes take the next frame right away
+                    self._submitted.setdefault(node, deque()).append(frames)
+                    self._threads.submit(self._work, node)
+                    self._condition.notify_all()  # wake producers that may now take it inline
+                if not self._running:
+                    break
+                self._condition.wait()
+            if self._error is not None:
+                error = self._error
+                self._error = None
+                raise error
+
+    def _execItem(self, item, cancel: threading.Event=None) -> dict:
+        with self._condition:
+            return super()._execItem(item, cancel)
+
+    def update(self, cancel: threading.Event=None) -> dict:
+        with self._condition:
+            return super().update(cancel)
+
+    def shutdown(self) -> None:
+        self._threads.shutdown()
+        if self._processes is not None:
+            self._processes.shutdown()
+
+
+class BatchResult:
+    def __init__(self, index: int, item, outputs: dict=None, error: str=None) -> None:
+        self.index = index
+        self.item = item
+        self.outputs = outputs
+        self.error = error
+
+    def ok(self) -> bool:
+        return self.error is None
+
+
+_batchPipeline = None
+
+def _batchInit(factory):
+    global _batchPipeline
+    _batchPipeline = factory if isinstance(factory, Pipeline) else factory()
+
+def _batchExec(index, item) -> BatchResult:
+    try:
+        outputs = _batchPipeline.exec([item])
+        return BatchResult(index, item, outputs[0] if outputs else {})
+    except Exception:
+        return BatchResult(index, item, error=traceback.format_exc())
+
+
+class BatchRunner:
+    '''
+    Runs items through copies of a pipeline in worker processes.
+    factory is either a Pipeline, which is pickled into every worker, or a
+    picklable callable (e.g. a module level function) building the pipeline;
+    every worker process calls it once.
+    At most window items (default twice the workers) are submitted at a time;
+    the next item is pulled from data only when a result has been consumed,
+    so neither data nor the results are ever materialized as a whole.
+    '''
+    def __init__(self, factory, workers: int=None, window: int=None) -> None:
+        self._factory = factory
+        self._workers = workers or os.cpu_count() or 1
+        self._window = window or 2 * self._workers
+
+    def run(self, data, ordered: bool=True):
+        '''
+        Yields a BatchResult per item, in input order or as they complete.
+        A failing item yields a result with error set, the batch goes on.
+        '''
+        items = enumerate(data)
+        with ProcessPoolExecutor(self._workers, initializer=_batchInit, initargs=(self._factory,)) as pool:
+            futures = deque(pool.submit(_batchExec, index, item)
+                            for index, item in itertools.islice(items, self._window))
+            while futures:
+                if ordered:
+                    done = [futures.popleft()]
+                else:
+                    done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        futures.remove(future)
+                for future in done:
+                    for index, item in itertools.islice(items, 1):
+                        futures.append(pool.submit(_batchExec, index, item))
+                    result = future.result()
+                    if not result.ok():
+                        log.error(f'Batch item {result.item} failed: {result.error}')
+                    yield result
+
+
 class Pipeline:
-    def __init__(self, sourceFilter: Source=None) -> None:
+    def __init__(self, sourceFilter: Source=None, threads: int=0, processes: int=0, factory=None) -> None:
+        '''
+        threads/processes > 0 run independent branches in parallel,
+        otherwise the graph is executed sequentially on the calling thread.
+        factory is a picklable callable building an equivalent pipeline for
+        execBatch() worker processes; without one the pipeline itself is pickled.
+        '''
         self._source = sourceFilter
-    
-    def exec(self, data):
-        self._source.exec(data)
+        self._threads = threads
+        self._processes = processes
+        self._factory = factory
+        self._executor = None
+        self._profiler = None
+        self._report = False
+
+    def executor(self) -> GraphExecutor:
+        if self._executor is None:
+            if self._threads or self._processes:
+                self._executor = ParallelExecutor(self._source, self._threads or None, self._processes)
+            else:
+                self._executor = GraphExecutor(self._source)
+            self._executor.setProfiler(self._profiler)
+        return self._executor
+
+    def nodes(self) -> list:
+        return self.executor().nodes()
+
+    def setProfiler(self, profiler: Profiler, report: bool=True) -> None:
+        '''Instruments every filter and pin, see profiling.Profiler; report logs a summary after each run.'''
+        self._profiler = profiler
+        self._report = report
+        self.executor().setProfiler(profiler)
+
+    def profiler(self) -> Profiler:
+        return self._profiler
+
+    def setCache(self, cache) -> None:
+        '''Enables memoization of filter outputs, see filter_cache.ResultCache.'''
+        for node in self.nodes():
+            if isinstance(node, Filter):
+                node.setCache(cache)
+
+    def find(self, name: str):
+        for node in self.nodes():
+            if node.name() == name:
+                return node
+        return None
+
+    def invalidate(self) -> None:
+        '''Drops the compiled graph; call after reconnecting pins.'''
+        self.close()
+
+    def close(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    def exec(self, data, cancel: threading.Event=None) -> list[dict]:
+        return list(self.stream(data, cancel))
+
+    def stream(self, data, cancel: threading.Event=None):
+        '''
+        Yields the outputs of one item at a time, pulling items lazily from data
+        (e.g. image_files.walkImages()), see GraphExecutor.stream().
+        '''
+        self.executor()
+        yield from self._source.stream(data, cancel)
+        if self._profiler is not None and self._report:
+            log.info(f'Pipeline profile:\n{self._profiler.summary()}')
+
+    def update(self, cancel: threading.Event=None) -> dict:
+        '''Incremental re-run after parameter changes, see GraphExecutor.update().'''
+        outputs = self.executor().update(cancel)
+        if self._profiler is not None and self._report:
+            log.info(f'Pipeline profile:\n{self._profiler.summary()}')
+        return outputs
+
+    def setRetain(self, retain: bool) -> None:
+        for node in self.nodes():
+            if isinstance(node, Filter):
+                node.setRetain(retain)
+
+    def execBatch(self, data, workers: int=None, ordered: bool=True, window: int=None):
+        '''
+        Batch mode: hands items to a pool of worker processes, each running its
+        own copy of the graph. Yields a BatchResult per item, see BatchRunner.
+        '''
+        factory = self if self._factory is None else self._factory
+        return BatchRunner(factory, workers, window).run(data, ordered)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.update(_executor=None, _profiler=None, _report=False)
+        return state
 
     def connect(input, output):
         pass
@@ -1,11 +1,12 @@
 import math
 import sys
+from functools import partial
 import numpy as np
 from enum import Flag
 from PyQt6 import QtCore
 from PyQt6.QtCore import Qt, QRect, QPoint
 from PyQt6.QtGui import QImage, QColor, QPainter, QPen, QFontMetrics, QMouseEvent
-from PyQt6.QtWidgets import QWidget, QVBoxLayout, QPushButton, QFileDialog, QSpinBox, QComboBox, QGridLayout, QLabel, QHBoxLayout
+from PyQt6.QtWidgets import QWidget, QVBoxLayout, QPushButton, QFileDialog, QSpinBox, QComboBox, QGridLayout, QLabel
 
 
 class HistogramOrientation(Flag):
@@ -34,7 +35,11 @@ class HistogramWidget(QWidget):
         self.setMouseTracking(True)
 
     def setHistogram(self, histogram):
-        self.histogram = histogram
+        '''Counts per bin; several histograms (e.g. per channel or region, see image_filters.Histogram) are summed.'''
+        histogram = np.asarray(histogram)
+        if histogram.ndim > 1:
+            histogram = histogram.reshape(-1, histogram.shape[-1]).sum(axis=0)
+        self.histogram = histogram.tolist()
         self.update()
     
     def setImage(self, image:QImage):
@@ -72,8 +77,8 @@ class HistogramWidget(QWidget):
             painter.setRenderHint(QPainter.RenderHint.Antialiasing)
 
             #max_value = max(self.histogram)
-            num_bins = (256 + self.bin_size - 1) // self.bin_size
-            bin_sums = [sum(self.histogram[i * self.bin_size:min((i + 1) * self.bin_size, 256)]) for i in range(num_bins)]
+            num_bins = (len(self.histogram) + self.bin_size - 1) // self.bin_size
+            bin_sums = [sum(self.histogram[i * self.bin_size:min((i + 1) * self.bin_size, len(self.histogram))]) for i in range(num_bins)]
             max_bin_sum = max(bin_sums)
 
             if isVertical(self.orientation):
@@ -86,7 +91,7 @@ class HistogramWidget(QWidget):
             if max_bin_sum > 0:
                 for i, bin_sum in enumerate(bin_sums):
                     bin_start = i * self.bin_size
-                    bin_end = min(bin_start + self.bin_size, 256)
+                    bin_end = min(bin_start + self.bin_size, len(self.histogram))
                     bin_sum = sum(self.histogram[bin_start:bin_end])
                     if self.logarithmic:
                         value = (math.log(bin_sum + 1) / math.log(max_bin_sum + 1))
@@ -123,7 +128,7 @@ class HistogramWidget(QWidget):
 
             if self.hovered_bin != -1:
                 bin_start = self.hovered_bin * self.bin_size
-                bin_end = min(bin_start + self.bin_size, 256)
+                bin_end = min(bin_start + self.bin_size, len(self.histogram))
                 bin_sum = sum(self.histogram[bin_start:bin_end])
 
                 if bin_start == bin_end - 1:
@@ -144,7 +149,7 @@ class HistogramWidget(QWidget):
 
     def mouseMoveEvent(self, event: QMouseEvent):
         if self.histogram is not None:
-            num_bins = (256 + self.bin_size - 1) // self.bin_size
+            num_bins = (len(self.histogram) + self.bin_size - 1) // self.bin_size
             bar_width = max(1, min(self.width() // num_bins, 20))
             bin_height = self.height() - 20
 
@@ -164,10 +169,13 @@ class HistogramWidget(QWidget):
 
 class GlcmWidget(QWidget):
     keys = ['contrast', 'dissimilarity', 'homogeneity', 'energy']
+    buttonColumns = 5
     def __init__(self, parent: QWidget | None = ...) -> None:
         super().__init__(parent)
-        self._selectedChannel = 0 # contrast
+        self._selectedKey = self.keys[0]
         self._gridLayout = None
+        self._buttons = []
+        self._buttonKeys = []
         self._setupUi()
     
     def _setupUi(self):
@@ -176,17 +184,36 @@ class GlcmWidget(QWidget):
         mainLayout = QVBoxLayout()
         gridLayout = QGridLayout()
         mainLayout.addLayout(gridLayout)
-        buttonsLayout = QHBoxLayout()
-        self._buttons = [self._createRadioPushButton('C', 'Contrast', self._selectedChannel==0, self._setContrast),
-            self._createRadioPushButton('D', 'Dissimilarity', self._selectedChannel==1, self._setDissimilarity),
-            self._createRadioPushButton('H', 'Homogeneity', self._selectedChannel==2, self._setHomogeneity),
-            self._createRadioPushButton('E', 'Energy', self._selectedChannel==3, self._setEnergy)]
-        for button in self._buttons:
-            buttonsLayout.addWidget(button)
-        mainLayout.addLayout(buttonsLayout)
+        self._buttonsLayout = QGridLayout()
+        self._setButtons(self.keys)
+        mainLayout.addLayout(self._buttonsLayout)
         self.setLayout(mainLayout)
         self._gridLayout = gridLayout
-        
+
+    def _setButtons(self, keys):
+        '''One button per feature the data holds, see data_filters.GLCM_FEATURES.'''
+        keys = list(keys)
+        if keys == self._buttonKeys:
+            return
+        for button in self._buttons:
+            self._buttonsLayout.removeWidget(button)
+            button.deleteLater()
+        if self._selectedKey not in keys:
+            self._selectedKey = keys[0]
+        self._buttons = []
+        for index, key in enumerate(keys):
+            button = self._createRadioPushButton(self._shortName(key), key[0].upper() + key[1:],
+                                                 key == self._selectedKey, partial(self._select, key))
+            self._buttonsLayout.addWidget(button, index // self.buttonColumns, index % self.buttonColumns)
+            self._buttons.append(button)
+        self._buttonKeys = keys
+
+    @staticmethod
+    def _shortName(key: str) -> str:
+        words = key.split()
+        if len(words) > 1:
+            return ''.join(word[0].upper() for word in words)
+        return key if key.isupper() or not key.isalpha() else key[:3].capitalize()
 
     def _createRadioPushButton(self, text, tooltip, isSelected, callback):
         button = QPushButton(text)
@@ -197,14 +224,27 @@ class GlcmWidget(QWidget):
         button.toggled.connect(callback)
         return button
 
-    def setData(self, data): # see data_filters.calcGlsm() for data format
+    def setData(self, data, meta: dict=None):
+        '''
+        data: a data_filters.calcGlcmFor() (props, distances, angles) array,
+        averaged when it holds several regions. meta: its 'props', 'distances'
+        and 'angles' axes, see data_filters.GlcmFilter.
+        '''
+        data = np.asarray(data)
+        if data.ndim > 3:
+            data = data.reshape((-1,) + data.shape[-3:]).mean(axis=0)
+        meta = meta or {}
         self._data = data
+        self._props = list(meta.get('props', self.keys))
+        self._distances = meta.get('distances', range(1, data.shape[1]+1))
+        self._angles = meta.get('angles', np.linspace(0, np.pi, data.shape[2]))
+        self._setButtons(self._props)
         self._updateData()
     
     def _updateData(self):
-        key = self.keys[self._selectedChannel]
-        distances = self._data[key]
-        w = QLabel(key[0:1].upper())
+        key = self._selectedKey
+        data = self._data[self._props.index(key)]
+        w = QLabel(self._shortName(key))
         w.setMaximumHeight(20)
         w.setAlignment(QtCore.Qt.AlignmentFlag.AlignCenter)
         ow = self._gridLayout.itemAtPosition(0, 0)
@@ -217,8 +257,8 @@ class GlcmWidget(QWidget):
         values = []
         coords = []
         minValue = sys.float_info.max
-        maxValue = 0.0
-        for j, (distance, angles) in enumerate(distances.items()):
+        maxValue = -sys.float_info.max
+        for j, distance in enumerate(self._distances):
             w = QLabel(f'{distance}')
             w.setAlignment(QtCore.Qt.AlignmentFlag.AlignCenter)
             w.setMaximumHeight(20)
@@ -228,7 +268,7 @@ class GlcmWidget(QWidget):
             else:
                 ow = self._gridLayout.replaceWidget(ow.widget(), w)
                 ow.widget().deleteLater()
-            for i, (angle, value) in enumerate(angles.items()):
+            for i, angle in enumerate(self._angles):
                 if j == 0:
                     w = QLabel(f'{math.degrees(angle):g}°')
                     w.setAlignment(QtCore.Qt.AlignmentFlag.AlignRight | QtCore.Qt.AlignmentFlag.AlignVCenter)
@@ -241,8 +281,8 @@ class GlcmWidget(QWidget):
                         ow = self._gridLayout.replaceWidget(ow.widget(), w)
                         ow.widget().deleteLater()
 
-                value = value[0]
-                w = QLabel(f'{value:.2f}')
+                value = float(data[j, i])
+                w = QLabel(f'{value:.3g}')
                 w.setAlignment(QtCore.Qt.AlignmentFlag.AlignRight | QtCore.Qt.AlignmentFlag.AlignVCenter)
                 w.setMaximumHeight(20)
                 w.setToolTip(f'{value}')
@@ -260,7 +300,7 @@ class GlcmWidget(QWidget):
                 if minValue > value:
                     minValue = value
         indices = np.argsort(values)
-        spread = maxValue - minValue
+        spread = maxValue - minValue or 1.0
         if spread < 0.2:
             spread *= 3
         elif spread < 0.5:
@@ -274,22 +314,7 @@ class GlcmWidget(QWidget):
             c2 = 0
             self._gridLayout.itemAtPosition(pos[0],pos[1]).widget().setStyleSheet(f'background-color: #{c1:02x}00{c2:02x}')
 
-    def _setContrast(self, isChecked):
-        if isChecked:
-            self._selectedChannel = 0
-            self._updateData()
-
-    def _setDissimilarity(self, isChecked):
-        if isChecked:
-            self._selectedChannel = 1
-            self._updateData()
-
-    def _setHomogeneity(self, isChecked):
-        if isChecked:
-            self._selectedChannel = 2
-            self._updateData()
-
-    def _setEnergy(self, isChecked):
+    def _select(self, key, isChecked):
         if isChecked:
-            self._selectedChannel = 3
+            self._selectedKey = key
             self._updateData()
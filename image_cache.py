@@ -0,0 +1,128 @@
+import os
+import threading
+import weakref
+from concurrent.futures import Future, ThreadPoolExecutor
+import numpy as np
+from PIL import Image
+import filters as f
+from filter_cache import MemoryCache, digest
+from log import ConsoleLog as log
+
+
+def decodeImage(path: str) -> np.ndarray:
+    '''Decodes an image file at full resolution into an ndarray.'''
+    with Image.open(path) as image:
+        return f.imageToArray(image)
+
+
+class ImageCache:
+    '''
+    Decoded images shared by everything showing or processing files (the
+    LoadImage filters, the crossing viewer), bounded by bytes. Concurrent
+    loads of one image decode it once. prefetch() decodes files in background
+    threads ahead of their use, e.g. the neighbours of the selected file.
+    Images are decoded at full resolution, or the way a loader added with
+    addLoader() decodes them (e.g. reduced, see image_filters.optimizeDecode()).
+    '''
+    def __init__(self, maxBytes: int=1024*1024*1024, threads: int=2) -> None:
+        self._memory = MemoryCache(maxBytes)
+        self._lock = threading.Lock()
+        self._loaders = weakref.WeakKeyDictionary()
+        self._loading = {}  # key -> Future of the decode in progress
+        self._prefetching = {}  # (path, loader) -> Future of the queued prefetch
+        self._threads = ThreadPoolExecutor(threads, thread_name_prefix='prefetch')
+
+    def addLoader(self, loader) -> None:
+        '''
+        Prefetches images for loader too: loader.decode(path) decodes an image,
+        loader.decodeVariant() tells its decodes apart from other ones.
+        '''
+        with self._lock:
+            self._loaders[loader] = True
+
+    def _key(self, path: str, loader) -> str:
+        stat = os.stat(path)
+        variant = None if loader is None else loader.decodeVariant()
+        return digest(path, stat.st_size, stat.st_mtime_ns, variant)
+
+    def lookup(self, path: str, loader=None, wait: bool=True) -> np.ndarray:
+        '''The decoded image if cached (or, with wait, being decoded), otherwise None.'''
+        key = self._key(path, loader)
+        value = self._memory.get(key)
+        if value is not None or not wait:
+            return value
+        with self._lock:
+            future = self._loading.get(key)
+        return None if future is None else future.result()
+
+    def load(self, path: str, loader=None) -> np.ndarray:
+        '''
+        The decoded image as a read-only ndarray, decoded on the calling thread
+        unless cached or in progress.
+        '''
+        key = self._key(path, loader)
+        value = self._memory.get(key)
+        if value is not None:
+            return value
+        with self._lock:
+            future = self._loading.get(key)
+            owner = future is None
+            if owner:
+                future = self._loading[key] = Future()
+        if not owner:
+            return future.result()
+        try:
+            value = decodeImage(path) if loader is None else loader.decode(path)
+            value.flags.writeable = False
+            self._memory.put(key, value)
+            future.set_result(value)
+            return value
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._loading[key]
+
+    def prefetch(self, paths: list) -> None:
+        '''
+        Decodes paths, most wanted first, for the viewers and every loader in
+        the background. Queued prefetches of files no longer in paths are dropped.
+        '''
+        with self._lock:
+            for (path, loader), future in list(self._prefetching.items()):
+                if path not in paths and future.cancel():
+                    del self._prefetching[(path, loader)]
+            loaders = [None] + list(self._loaders.keys())
+            for path in paths:
+                for loader in loaders:
+                    if (path, loader) not in self._prefetching:
+                        future = self._threads.submit(self._prefetch, path, loader)
+                        self._prefetching[(path, loader)] = future
+
+    def _prefetch(self, path: str, loader) -> None:
+        try:
+            self.load(path, loader)
+        except Exception as e:
+            log.warn(f'Cannot prefetch {path}: {e}')
+        finally:
+            with self._lock:
+                self._prefetching.pop((path, loader), None)
+
+    def clear(self) -> None:
+        self._memory.clear()
+
+    def shutdown(self) -> None:
+        self._threads.shutdown(wait=False, cancel_futures=True)
+
+
+_sharedCache = None
+_sharedLock = threading.Lock()
+
+def sharedImageCache() -> ImageCache:
+    '''The image cache of the application, created on first use.'''
+    global _sharedCache
+    with _sharedLock:
+        if _sharedCache is None:
+            _sharedCache = ImageCache()
+        return _sharedCache
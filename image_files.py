@@ -0,0 +1,15 @@
+import os
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.gif', '.bmp', '.tif', '.tiff')
+
+def walkImages(directory: str, extensions: tuple=IMAGE_EXTENSIONS):
+    '''
+    Lazily yields the paths of the image files below directory, in a stable
+    order. Feed it to Pipeline.stream() or execBatch() to process directory
+    trees of any size without listing them first.
+    '''
+    for root, dirs, files in os.walk(directory):
+        dirs.sort()
+        for file in sorted(files):
+            if file.lower().endswith(extensions):
+                yield os.path.join(root, file)
@@ -6,6 +6,8 @@ import PyQt6.QtCore as QtCore
 from PIL import Image, ImageQt
 
 from log import ConsoleLog as log
+from image_files import walkImages
+from image_cache import sharedImageCache
 
 class ImageFilesWidget(QListWidget):
     file_selected = pyqtSignal(str)
@@ -17,6 +19,9 @@ class ImageFilesWidget(QListWidget):
         self.layout = QVBoxLayout()
         self.setLayout(self.layout)
         self.files = {}
+        # neighbours on each side of the current item decoded in the background
+        self.prefetch_count = 2
+        self.image_cache = sharedImageCache()
         self.currentItemChanged.connect(self._select_file)
         self.itemActivated.connect(self._activate_file)
         # self.itemEntered.connect(self.__showTooltip)
@@ -45,10 +50,8 @@ class ImageFilesWidget(QListWidget):
         return super().eventFilter(object, event)
     
     def open_folder(self, folder_path):
-        for root, dirs, files in os.walk(folder_path):
-            for file in files:
-                if file.lower().endswith(('.png', '.jpg', '.jpeg', '.gif', '.bmp', '.tif', '.tiff')):
-                    self.open_file(os.path.join(root, file))
+        for file_path in walkImages(folder_path):
+            self.open_file(file_path)
 
     def open_file(self, file_path):
         item = QListWidgetItem(self)
@@ -67,9 +70,19 @@ class ImageFilesWidget(QListWidget):
         for item in items:
             self.setCurrentItem(item)
 
+    def _prefetch_neighbours(self, item):
+        row = self.row(item)
+        paths = [item.file_path]
+        for offset in range(1, self.prefetch_count + 1):
+            for neighbour in (row + offset, row - offset):
+                if 0 <= neighbour < self.count():
+                    paths.append(self.item(neighbour).file_path)
+        self.image_cache.prefetch(paths)
+
     @QtCore.pyqtSlot(QListWidgetItem)
     def _select_file(self, item):
         if item is not None:
+            self._prefetch_neighbours(item)
             self.file_selected.emit(item.file_path)
 
     @QtCore.pyqtSlot(QListWidgetItem)
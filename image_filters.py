@@ -1,22 +1,267 @@
+import json
+import math
+import os
+from fractions import Fraction
 import filters as f
-from PIL import Image, ImageQt
-import dlib
+from filter_cache import digest
+from resize_backends import resizeArray, reduceFactors, chooseBackend
+from PIL import Image
 import numpy as np
 from log import ConsoleLog as log
 import cv2
+try:
+    import tifffile
+except ImportError:
+    tifffile = None
+
+def tileRects(size: tuple, tileSize: tuple, overlap: int=0):
+    '''
+    Yields (core, tile) rects covering an image of size (width, height): the
+    cores partition the image, each tile is its core grown by overlap pixels.
+    '''
+    width, height = size
+    tileWidth, tileHeight = tileSize
+    for top in range(0, height, tileHeight):
+        for left in range(0, width, tileWidth):
+            right, bottom = min(left + tileWidth, width), min(top + tileHeight, height)
+            yield ((left, top, right, bottom),
+                   (max(0, left - overlap), max(0, top - overlap),
+                    min(width, right + overlap), min(height, bottom + overlap)))
+
+def tileCore(frame: f.Frame) -> np.ndarray:
+    '''
+    The part of a tile frame its tile owns (without the overlap), the whole
+    value for other frames. Reductions over tiles must only look at the core.
+    '''
+    meta = frame.meta()
+    if 'tile' not in meta:
+        return frame.value()
+    tile, core = meta['tile'], meta['core']
+    return frame.value()[core[1]-tile[1]:core[3]-tile[1], core[0]-tile[0]:core[2]-tile[0]]
+
+
+class _ArrayRegions:
+    '''Rects of an image decoded as a whole; regions are views.'''
+    def __init__(self, array: np.ndarray) -> None:
+        self._array = array
+
+    def size(self) -> tuple:
+        return (self._array.shape[1], self._array.shape[0])
+
+    def read(self, rect: tuple) -> np.ndarray:
+        return cropArray(self._array, rect)
+
+    def close(self) -> None:
+        self._array = None
+
+
+class _TiffRegions:
+    '''
+    Rects of the first page of a TIFF, read lazily: uncompressed images are
+    memory mapped, compressed ones decode only the strips or tiles a rect covers.
+    '''
+    def __init__(self, path: str) -> None:
+        self._tiff = tifffile.TiffFile(path)
+        self._page = self._tiff.pages[0]
+        self._array = None
+        if self._page.is_memmappable:
+            self._array = tifffile.memmap(path, page=0, mode='r')
+        elif self._page.planarconfig != 1 or self._page.ndim not in (2, 3):
+            self._array = self._page.asarray()
+
+    def size(self) -> tuple:
+        return (self._page.shape[1], self._page.shape[0])
+
+    def read(self, rect: tuple) -> np.ndarray:
+        if self._array is not None:
+            return cropArray(self._array, rect)
+        page = self._page
+        left, top, right, bottom = rect
+        chunkHeight, chunkWidth = page.chunks[:2]
+        columns = page.chunked[1]
+        region = np.empty((bottom - top, right - left) + page.shape[2:], page.dtype)
+        handle = self._tiff.filehandle
+        for row in range(top // chunkHeight, (bottom - 1) // chunkHeight + 1):
+            for column in range(left // chunkWidth, (right - 1) // chunkWidth + 1):
+                index = row * columns + column
+                handle.seek(page.dataoffsets[index])
+                data = handle.read(page.databytecounts[index])
+                segment = page.decode(data, index, jpegtables=page.jpegtables)[0][0]
+                if page.ndim == 2:
+                    segment = segment[..., 0]
+                y, x = row * chunkHeight, column * chunkWidth
+                y0, y1 = max(top, y), min(bottom, y + segment.shape[0])
+                x0, x1 = max(left, x), min(right, x + segment.shape[1])
+                region[y0-top:y1-top, x0-left:x1-left] = segment[y0-y:y1-y, x0-x:x1-x]
+        return region
+
+    def close(self) -> None:
+        self._array = None
+        self._tiff.close()
+
+
+def openRegions(path: str):
+    '''Opens an image for reading rects, lazily where the format allows it.'''
+    if tifffile is not None and path.lower().endswith(('.tif', '.tiff')):
+        try:
+            return _TiffRegions(path)
+        except Exception as e:
+            log.warn(f'Reading {path} as a whole: {e}')
+    with Image.open(path) as image:
+        return _ArrayRegions(f.imageToArray(image))
+
 
 class LoadImage(f.Filter):
-    def __init__(self) -> None:
+    '''
+    Loads an image. With a tileSize the image is pushed as overlapping tiles
+    instead, one frame per tile tagged with 'tile', 'core', 'tiles' and 'size'
+    meta (see tileRects()); tiles are read lazily where the format allows it
+    and never cached, so memory stays bounded by a few tiles. overlap must
+    cover the margin of the tile-local filters downstream.
+    With a decode hint (see optimizeDecode()) whole images are decoded at
+    the lowest resolution still covering the output of the hinted resize:
+    JPEG DCT scaling or the matching level of a pyramidal TIFF.
+    With an image cache (see image_cache.ImageCache) whole images are taken
+    from the cache, where they may have been prefetched.
+    '''
+    WORKLOAD = f.Workload.IO
+    REDUCING_GAP = 2.0
+
+    def __init__(self, tileSize: tuple=None, overlap: int=16) -> None:
         super().__init__('Image Load')
         self._inputs.append(f.InputPin(self, 0))
         self._outputs.append(f.OutputPin(self, 0))
+        self._tileSize = tileSize
+        self._overlap = overlap
+        self._decodeHint = None
+        self._imageCache = None
+
+    def __getstate__(self):
+        state = super().__getstate__()
+        state['_imageCache'] = None
+        return state
+
+    def setImageCache(self, cache) -> None:
+        self._imageCache = cache
+        if cache is not None:
+            cache.addLoader(self)
+
+    def setTiling(self, tileSize: tuple, overlap: int=16) -> None:
+        self._tileSize = tileSize
+        self._overlap = overlap
+        self.invalidate()
+
+    def tileSize(self) -> tuple:
+        return self._tileSize
+
+    def setDecodeHint(self, resize) -> None:
+        '''resize is the ResizeImage the decoded image ends up in, None decodes at full size.'''
+        if self._decodeHint is not None:
+            self._decodeHint.removeDependent(self)
+        self._decodeHint = resize
+        if resize is not None:
+            resize.addDependent(self)  # a new size needs a new decode
+        self.invalidate()
+
+    def decodeHint(self):
+        return self._decodeHint
+
+    def decodeSize(self, size: tuple) -> tuple:
+        '''Smallest (width, height) worth decoding an image of the given size at.'''
+        if self._decodeHint is None:
+            return size
+        # like PIL's reducing_gap: leave the exact resize at least this factor,
+        # decoding right at the output size costs visible accuracy
+        width, height = self._decodeHint.outputSize(size)
+        gap = self.REDUCING_GAP
+        return (min(size[0], math.ceil(width * gap)), min(size[1], math.ceil(height * gap)))
+
+    def decodeVariant(self) -> tuple:
+        return (type(self).__name__, None if self._decodeHint is None else self._decodeHint.params())
+
+    def params(self) -> tuple:
+        hint = None if self._decodeHint is None else self._decodeHint.params()
+        return (self._tileSize, self._overlap, hint)
+
+    def cacheKey(self, inputPin, frame: f.Frame) -> str:
+        if self._tileSize is not None:
+            return None
+        stat = os.stat(frame.value())
+        return digest(type(self).__name__, self.params(), frame.value(), stat.st_size, stat.st_mtime_ns)
 
     def exec(self, inputPin, frame:f.Frame):
         super().exec(inputPin, frame)
         file_path = frame.value()
-        image = Image.open(file_path)
-        log.info(f'Loaded image mode={image.mode}')
-        self.pushOne(f.Frame(image, self, inputPin))
+        if self._tileSize is not None:
+            self._execTiled(inputPin, file_path)
+            return
+        if self._imageCache is not None:
+            loaded = self._imageCache.load(file_path, self)
+        else:
+            loaded = self.decode(file_path)
+        self.pushOne(f.Frame(loaded, self, inputPin, meta={'path': file_path}))
+
+    def decode(self, file_path: str) -> np.ndarray:
+        '''Decodes a whole image, at a reduced resolution with a decode hint.'''
+        if self._decodeHint is not None and tifffile is not None and file_path.lower().endswith(('.tif', '.tiff')):
+            loaded = self._readLevel(file_path)
+            if loaded is not None:
+                return loaded
+        with Image.open(file_path) as image:
+            size = image.size
+            target = self.decodeSize(size)
+            if target[0] < size[0] and target[1] < size[1]:
+                # scaled decoding, for the formats supporting it (JPEG)
+                image.draft(image.mode, target)
+            log.info(f'Loaded image mode={image.mode} size={size} decoded={image.size}')
+            return f.imageToArray(image)
+
+    def _readLevel(self, file_path: str) -> np.ndarray:
+        '''Smallest level of a pyramidal TIFF covering the decode size, None for flat TIFFs.'''
+        try:
+            with tifffile.TiffFile(file_path) as tiff:
+                levels = tiff.series[0].levels
+                if len(levels) < 2 or not levels[0].axes.startswith('YX'):
+                    return None
+                size = (levels[0].shape[1], levels[0].shape[0])
+                target = self.decodeSize(size)
+                chosen = levels[0]
+                for level in levels[1:]:
+                    if level.shape[1] >= target[0] and level.shape[0] >= target[1]:
+                        chosen = level
+                log.info(f'Loaded image level size={size} decoded={chosen.shape[1::-1]}')
+                return chosen.asarray()
+        except Exception as e:
+            log.warn(f'Reading {file_path} with PIL: {e}')
+            return None
+
+    def _execTiled(self, inputPin, file_path: str) -> None:
+        regions = openRegions(file_path)
+        try:
+            size = regions.size()
+            rects = list(tileRects(size, self._tileSize, self._overlap))
+            log.info(f'Loading {file_path} as {len(rects)} tiles')
+            for core, tile in rects:
+                meta = {'path': file_path, 'tile': tile, 'core': core, 'tiles': len(rects), 'size': size}
+                self.pushOne(f.Frame(regions.read(tile), self, inputPin, meta=meta))
+        finally:
+            regions.close()
+
+def cropArray(array: np.ndarray, rect) -> np.ndarray:
+    '''
+    Crops (left, upper, right, lower) like PIL's Image.crop(). Returns a view
+    when the rect lies inside the image, a zero padded copy otherwise.
+    '''
+    left, top, right, bottom = (int(round(v)) for v in rect)
+    height, width = array.shape[:2]
+    if left >= 0 and top >= 0 and right <= width and bottom <= height:
+        return array[top:bottom, left:right]
+    cropped = np.zeros((max(bottom-top, 0), max(right-left, 0)) + array.shape[2:], array.dtype)
+    x0, y0 = max(left, 0), max(top, 0)
+    x1, y1 = min(right, width), min(bottom, height)
+    if x0 < x1 and y0 < y1:
+        cropped[y0-top:y1-top, x0-left:x1-left] = array[y0:y1, x0:x1]
+    return cropped
 
 class CropImage(f.Filter):
     def __init__(self, rect=None) -> None:
@@ -25,19 +270,186 @@ class CropImage(f.Filter):
         self._outputs.append(f.OutputPin(self, 0))
         
         self._cropRect = rect
+        self._roiCrop = None
     
     def setCropRect(self, rect):
-        self._cropRect = rect
+        previous, self._cropRect = self._cropRect, rect
+        if self._roiCrop is not None and not self._roiCrop.covers(previous, rect):
+            self._roiCrop.invalidate()
+        else:
+            self.invalidate()
+
+    def cropRect(self):
+        return self._cropRect
+
+    def params(self) -> tuple:
+        return (self._cropRect,)
 
     def exec(self, inputPin, frame:f.Frame):
         super().exec(inputPin, frame)
-        image = frame.value()
-        cropped = image.crop(self._cropRect)
+        rect = self._cropRect
+        roi = frame.meta().get('roi')
+        if roi is not None:
+            # input is a region cropped early, move the rect into its coordinates
+            left, top = roi[0], roi[1]
+            rect = (rect[0]-left, rect[1]-top, rect[2]-left, rect[3]-top)
+        cropped = cropArray(frame.value(), rect)
         self.pushOne(f.Frame(cropped, self, inputPin))
 
 
+REGIONS_FILE = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'data', 'regions.json')
+# regions are selected on images fitted into this box, see select_regions.py
+REGIONS_WIDTH, REGIONS_HEIGHT = 1280, 960
+
+def regionsScale(size: tuple) -> float:
+    '''Factor from selection image to image coordinates, for an image of size (width, height).'''
+    width, height = size
+    if width == REGIONS_WIDTH:
+        return 1.0  # shown unscaled
+    return 1 / min(REGIONS_WIDTH / width, REGIONS_HEIGHT / height)
+
+def loadRegions(file_path: str=REGIONS_FILE) -> dict:
+    '''
+    Reads the regions saved by SelectRegionsDialog: normalized image path ->
+    list of (shape, cx, cy, size), shape being 'SQUARE' or 'CIRCLE'.
+    '''
+    try:
+        with open(file_path) as file:
+            saved = json.load(file)
+    except (OSError, ValueError):
+        return {}
+    regions = {}
+    for path, value in saved.items():
+        shapes = []
+        for region in (value or {}).get('regions') or []:
+            if 'shape' in region:
+                cx, cy, size = region['coords']
+                shapes.append((region['shape'], cx, cy, size))
+            else:
+                # early files stored squares as (left, top, right, bottom)
+                left, top, right, bottom = region['coords']
+                shapes.append(('SQUARE', (left + right) / 2, (top + bottom) / 2, right - left))
+        regions[os.path.abspath(path).replace('\\', '/')] = shapes
+    return regions
+
+def extractRegions(image: np.ndarray, regions: list, scale: float=1.0, origin: tuple=(0, 0)) -> list:
+    '''
+    Extracts regions [(shape, cx, cy, size)] of an image, with coordinates
+    multiplied by scale and relative to origin (x, y) in the image. Circles span a square of side size * sqrt(2).
+    Patches of the same side are gathered in one fancy-indexing pass into an
+    (N, side, side) stack. Returns a list of (indices, patches, masks): masks
+    is an (N, side, side) bool stack of the pixels inside the circles and the
+    image, None when every patch is a square inside the image.
+    '''
+    groups = {}
+    for index, (shape, cx, cy, size) in enumerate(regions):
+        side = size * math.sqrt(2) if shape == 'CIRCLE' else size
+        side = max(1, int(round(side * scale)))
+        groups.setdefault(side, []).append((index, shape, cx * scale - origin[0], cy * scale - origin[1]))
+    height, width = image.shape[:2]
+    batches = []
+    for side, members in groups.items():
+        indices = np.array([member[0] for member in members])
+        lefts = np.array([int(round(cx - side / 2)) for _, _, cx, _ in members])
+        tops = np.array([int(round(cy - side / 2)) for _, _, _, cy in members])
+        # clip the windows into the padded image, so every index is valid
+        pad = side
+        padded = np.pad(image, ((pad, pad), (pad, pad)) + ((0, 0),) * (image.ndim - 2))
+        lefts = np.clip(lefts, -pad, width)
+        tops = np.clip(tops, -pad, height)
+        rows = (tops + pad)[:, None] + np.arange(side)[None, :]
+        columns = (lefts + pad)[:, None] + np.arange(side)[None, :]
+        patches = padded[rows[:, :, None], columns[:, None, :]]
+
+        inside = (((rows - pad >= 0) & (rows - pad < height))[:, :, None]
+                  & ((columns - pad >= 0) & (columns - pad < width))[:, None, :])
+        circles = np.array([member[1] == 'CIRCLE' for member in members])
+        masks = None
+        if circles.any() or not inside.all():
+            radius = side / 2
+            center = np.arange(side) + 0.5 - radius
+            disc = center[:, None] ** 2 + center[None, :] ** 2 <= radius ** 2
+            masks = inside & np.where(circles[:, None, None], disc[None], True)
+        batches.append((indices, patches, masks))
+    return batches
+
+
+class RegionCrop(f.Filter):
+    '''
+    Crops every region selected for the image's file (the frame's 'path' meta,
+    see LoadImage) in data/regions.json. Pushes a single (N, side, side) stack
+    in the file's region order, smaller regions padded to the largest side,
+    with 'regions' (indices into the file's region list), 'shapes' and 'mask'
+    (see extractRegions(), False on the padding) meta. Region coordinates are
+    scaled from the selection images, fitted into REGIONS_WIDTH x REGIONS_HEIGHT,
+    to the input (see regionsScale()).
+    '''
+    def __init__(self, file_path: str=REGIONS_FILE) -> None:
+        super().__init__('Region Crop')
+        self._inputs.append(f.InputPin(self, 0))
+        self._outputs.append(f.OutputPin(self, 0))
+        self._filePath = file_path
+        self._regions = {}
+        self._stamp = None
+
+    def regions(self, path: str) -> list:
+        '''The regions of an image file, re-reading the regions file when it changed.'''
+        try:
+            stamp = os.stat(self._filePath).st_mtime_ns
+        except OSError:
+            stamp = None
+        if stamp != self._stamp:
+            self._regions = loadRegions(self._filePath)
+            self._stamp = stamp
+        return self._regions.get(os.path.abspath(path).replace('\\', '/'), [])
+
+    def params(self) -> tuple:
+        return (self._filePath,)
+
+    def cacheKey(self, inputPin: f.InputPin, frame: f.Frame) -> str:
+        regions = self.regions(frame.meta().get('path', ''))
+        return f.digest(super().cacheKey(inputPin, frame), regions)
+
+    def exec(self, inputPin: f.InputPin, frame: f.Frame):
+        super().exec(inputPin, frame)
+        path = frame.meta().get('path')
+        regions = [] if path is None else self.regions(path)
+        if not regions:
+            log.warn(f'No regions for {path}')
+            return
+        # a region cropped early by RoiCrop sits at roi in the full image
+        height, width = frame.shape()[:2]
+        left, top, width, height = frame.meta().get('roi', (0, 0, width, height))
+        batches = extractRegions(frame.value(), regions, regionsScale((width, height)), (left, top))
+        if len(batches) == 1:
+            indices, stack, mask = batches[0]
+        else:
+            side = max(patches.shape[1] for _, patches, _ in batches)
+            indices = np.concatenate([indices for indices, _, _ in batches])
+            order = np.argsort(indices)
+            stack = np.zeros((len(indices), side, side) + frame.shape()[2:], frame.dtype())
+            mask = np.zeros((len(indices), side, side), bool)
+            start = 0
+            for _, patches, masks in batches:
+                count, patchSide = patches.shape[:2]
+                stack[start:start+count, :patchSide, :patchSide] = patches
+                mask[start:start+count, :patchSide, :patchSide] = True if masks is None else masks
+                start += count
+            indices, stack, mask = indices[order], stack[order], mask[order]
+        meta = {'path': path, 'regions': indices, 'mask': mask,
+                'shapes': [regions[index][0] for index in indices]}
+        self.pushOne(f.Frame(stack, self, inputPin, meta=meta))
+
+
 class ResizeImage(f.Filter):
-    def __init__(self, dim=None, keepAspectRatio: bool=True, upsize: bool=True) -> None:
+    '''
+    Resizes images to a width. backend is one of resize_backends.BACKENDS
+    ('pil', 'cv2', 'numpy'), 'auto' picks the fastest for the image's dtype
+    and scale factor from the bundled benchmark.
+    '''
+    ROI = True
+
+    def __init__(self, dim=None, keepAspectRatio: bool=True, upsize: bool=True, backend: str='auto') -> None:
         super().__init__('Image Size')
         self._inputs.append(f.InputPin(self, 0))
         self._outputs.append(f.OutputPin(self, 0))
@@ -45,106 +457,677 @@ class ResizeImage(f.Filter):
         self._dim = dim
         self._upsize = upsize
         self._keepAspectRatio = keepAspectRatio
+        self._backend = backend
 
     def setSize(self, dim, keepAspectRatio: bool=True, upsize: bool=True):
         self._dim = dim
         self._upsize = upsize
         self._keepAspectRatio = keepAspectRatio
+        self.invalidate()
+
+    def setBackend(self, backend: str) -> None:
+        self._backend = backend
+        self.invalidate()
+
+    def backend(self) -> str:
+        return self._backend
+
+    def params(self) -> tuple:
+        return (self._dim, self._keepAspectRatio, self._upsize, self._backend)
+
+    def inputGrid(self, inputSize: tuple, outputSize: tuple, dtype=np.uint8) -> tuple:
+        shape = (inputSize[1], inputSize[0])
+        backend = self._backend
+        if backend == 'auto':
+            backend = chooseBackend(dtype, shape, outputSize)
+        if backend != 'pil':
+            return (1, 1)
+        # PIL reduces integer blocks before resampling
+        return reduceFactors(shape, outputSize)
+
+    def outputSize(self, size: tuple) -> tuple:
+        imageWidth, imageHeight = size
+        width = self._dim[0]
+        if imageWidth > width or (self._upsize and imageWidth < width):
+            r = self._dim[0] / imageWidth
+            return (self._dim[0], int(imageHeight * r))
+        return size
+
+    def mapRectToInput(self, rect: tuple, inputSize: tuple, outputSize: tuple) -> tuple:
+        sx = Fraction(outputSize[0], inputSize[0])
+        sy = Fraction(outputSize[1], inputSize[1])
+        # resampling support, in input pixels
+        mx = math.ceil(2 / sx) + 1
+        my = math.ceil(2 / sy) + 1
+        return (math.floor(rect[0] / sx) - mx, math.floor(rect[1] / sy) - my,
+                math.ceil(rect[2] / sx) + mx, math.ceil(rect[3] / sy) + my)
 
     def exec(self, inputPin, frame: f.Frame):
         super().exec(inputPin, frame)
-        image = frame.value()
-        width = self._dim[0]
-        height = self._dim[1]
-        if image.width > width or (self._upsize and image.width < width):
-            r = self._dim[0] / image.width
-            dim = (self._dim[0], int(image.height * r))
-            sized = image.resize(dim)
+        imageHeight, imageWidth = frame.shape()[:2]
+        meta = frame.meta()
+        roi = meta.get('roi')
+        if roi is not None:
+            # a region cropped early: scale it like the full image would be scaled
+            left, top, fullWidth, fullHeight = roi
+            outWidth, outHeight = self.outputSize((fullWidth, fullHeight))
+            sx, sy = outWidth / fullWidth, outHeight / fullHeight
+            dim = (round(imageWidth * sx), round(imageHeight * sy))
+            meta = dict(meta, roi=(left * sx, top * sy, outWidth, outHeight))
+        else:
+            dim = self.outputSize((imageWidth, imageHeight))
+        if dim != (imageWidth, imageHeight):
+            sized = resizeArray(frame.value(), dim, self._backend)
         else:
-            sized = image
+            sized = frame.value()
 
-        self.pushOne(f.Frame(sized, self, inputPin))
+        self.pushOne(f.Frame(sized, self, inputPin, meta=meta))
 
 from skimage.restoration import inpaint
 
+INPAINT_RADIUS = 3
+INPAINT_BLOCK = 8  # > 2 * INPAINT_RADIUS
+
+def inpaintSaturated(image):
+    '''
+    Inpaints (nearly) saturated white pixels of an image, returns an ndarray.
+    Only boxes around the highlights are inpainted: the mask is reduced to
+    blocks, highlights less than two blocks apart share a box (they would
+    otherwise see each other's unfilled pixels) and every box keeps a block
+    of context around its highlights, so the result is the same as inpainting
+    the whole image. An image without highlights is returned as is.
+    '''
+    image = np.asarray(image)
+    white_intensity = 255
+    _, mask = cv2.threshold(image, white_intensity-3, white_intensity, cv2.THRESH_BINARY)
+    if mask.ndim == 3:
+        mask = mask.max(axis=2)
+    if not mask.any():
+        return image
+    block = INPAINT_BLOCK
+    height, width = mask.shape
+    rows, columns = -(-height // block), -(-width // block)
+    blocks = np.zeros((rows * block, columns * block), np.uint8)
+    blocks[:height, :width] = mask
+    blocks = cv2.resize(blocks, (columns, rows), interpolation=cv2.INTER_AREA)  # nonzero: any pixel masked
+    grown = cv2.dilate(blocks, np.ones((3, 3), np.uint8))
+    count, labels, stats, _ = cv2.connectedComponentsWithStats(grown, connectivity=8)
+    result = image.copy()
+    for label in range(1, count):
+        left, top, boxWidth, boxHeight = stats[label, :4]
+        box = np.s_[top*block:(top+boxHeight)*block, left*block:(left+boxWidth)*block]
+        owned = (labels[top:top+boxHeight, left:left+boxWidth] == label).repeat(block, 0).repeat(block, 1)
+        boxMask = mask[box] * owned[:mask[box].shape[0], :mask[box].shape[1]]
+        inpainted = cv2.inpaint(image[box], boxMask, inpaintRadius=INPAINT_RADIUS, flags=cv2.INPAINT_TELEA)
+        where = boxMask > 0
+        np.copyto(result[box], inpainted, where=where if image.ndim == 2 else where[..., None])
+    return result
+
 class ImageInpaint(f.Filter):
+    WORKLOAD = f.Workload.CPU
+    ROI = True
+    REENTRANT = True
+
     def __init__(self) -> None:
         super().__init__('Image Inprint')
         self._inputs.append(f.InputPin(self, 0))
         self._outputs.append(f.OutputPin(self, 0))
+
+    def margin(self) -> int:
+        # inpaint radius plus room for highlights crossing the region border
+        return 16
     
     def exec(self, inputPin: f.InputPin, frame: f.Frame) -> None:
         super().exec(inputPin, frame)
         lower_white = np.array([255, 255, 255])
         upper_white = np.array([255, 255, 255])
 
-        image = np.array(frame.value())
-        white_intensity = 255
-        _, mask = cv2.threshold(image, white_intensity-3, white_intensity, cv2.THRESH_BINARY)
-        inpainted_img_cv = cv2.inpaint(image, mask, inpaintRadius=3, flags=cv2.INPAINT_TELEA)
-        result = Image.fromarray(inpainted_img_cv)
+        result = self.compute(inpaintSaturated, frame.value())
 
         # mask = cv2.inRange(image, lower_white, upper_white)
         # result = cv2.inpaint(image, mask, inpaintRadius=3, flags=cv2.INPAINT_TELEA)
         #mask = image >= 0.9
         #result = inpaint.inpaint_biharmonic(image, mask, multichannel=True)
-        self.pushOne(f.Frame(result, self, inputPin))
+        self.pushOne(f.Frame(result, self, inputPin, meta=frame.meta()))
+
+
+def _modeTraits(mode: str) -> tuple:
+    # (colour, alpha, bits, float) of an ARRAY_MODES mode
+    dtype, channels = f.ARRAY_MODES[mode]
+    bits = {'1': 1, 'F': 24}.get(mode, np.dtype(dtype).itemsize * 8)
+    return (channels >= 3, channels in (2, 4), bits, mode == 'F')
+
+def representable(mode: str, target: str) -> bool:
+    '''Whether converting mode to target keeps every value (e.g. L to RGB, not RGB to L).'''
+    colour, alpha, bits, isFloat = _modeTraits(mode)
+    targetColour, targetAlpha, targetBits, targetFloat = _modeTraits(target)
+    return (targetColour >= colour and targetAlpha >= alpha and targetBits >= bits
+            and targetFloat >= isFloat)
+
+def frameMode(frame: f.Frame) -> str:
+    '''The mode of an image frame, of its images for region stacks (see RegionCrop).'''
+    value = frame.value()
+    if 'regions' in frame.meta():
+        return f.arrayMode(value[0]) if len(value) else None
+    return frame.mode()
 
 
 class ConvertImage(f.Filter):
-    def __init__(self, targetFormat, sourceFormats=None) -> None:
+    '''
+    Converts images to targetFormat, a chain of modes once fused by
+    negotiateFormats(). Frames already in the target, or in one of
+    keepFormats, pass through unconverted; steps of a chain the image
+    converts to without loss are skipped (L -> RGB -> L does nothing).
+    '''
+    ROI = True
+
+    def __init__(self, targetFormat, sourceFormats=None, keepFormats: tuple=None) -> None:
         super().__init__(f'Image Convert')
-        self._targetFormat = targetFormat
+        self._targets = [targetFormat] if isinstance(targetFormat, str) else list(targetFormat)
         self._sourceFormats = sourceFormats
-        self._inputs.append(f.InputPin(self, 0))
-        self._outputs.append(f.OutputPin(self, 0))
+        self._keepFormats = keepFormats
+        self._inputs.append(f.InputPin(self, 0, sourceFormats))
+        self._outputs.append(f.OutputPin(self, 0, format=self._outputFormat()))
 
     def name(self):
-        return f'Image Convert ({self._name})'
+        return f'Image Convert ({self._targets[-1]})'
+
+    def targets(self) -> list:
+        return list(self._targets)
+
+    def keepFormats(self) -> tuple:
+        return self._keepFormats
+
+    def _outputFormat(self) -> str:
+        return None if self._keepFormats else self._targets[-1]
+
+    def fuse(self, previous) -> None:
+        '''Takes over the conversions of the ConvertImage feeding this one.'''
+        self._targets = previous.targets() + self._targets
+        self.output().setFormat(self._outputFormat())
+
+    def append(self, targetFormat: str, keepFormats: tuple=None) -> None:
+        '''Converts to targetFormat after the current targets, unless in keepFormats.'''
+        self._targets.append(targetFormat)
+        self._keepFormats = keepFormats
+        self.output().setFormat(self._outputFormat())
+
+    def params(self) -> tuple:
+        return (tuple(self._targets), self._keepFormats)
+
+    def steps(self, mode: str) -> list:
+        '''The conversions an image of mode goes through.'''
+        if self._keepFormats and mode in self._keepFormats:
+            return []
+        steps = []
+        current = mode
+        for index, target in enumerate(self._targets):
+            last = index == len(self._targets) - 1
+            if target == current or (not last and current is not None and representable(current, target)):
+                continue
+            steps.append(target)
+            current = target
+        return steps
 
     def exec(self, inputPin:f.InputPin, frame:f.Frame):
         super().exec(inputPin, frame)
-        image = frame.value()
-        image = image.convert(self._targetFormat)
-        self.pushOne(f.Frame(image, self, inputPin))
+        steps = self.steps(frameMode(frame))
+        if not steps:
+            self.pushOne(f.Frame(frame.value(), self, inputPin, meta=frame.meta()))
+            return
+        def convert(array):
+            image = Image.fromarray(array)
+            for step in steps:
+                image = image.convert(step)
+            return f.imageToArray(image)
+        if 'regions' in frame.meta():
+            converted = np.stack([convert(array) for array in frame.value()])
+        else:
+            converted = convert(frame.value())
+        self.pushOne(f.Frame(converted, self, inputPin, meta=frame.meta()))
+
+
+class RoiCrop(f.Filter):
+    '''
+    Inserted by optimizeCrops() ahead of a chain of ROI transparent filters
+    ending in a CropImage. Crops the input to the region the final crop needs,
+    mapped back through the chain (with margins for neighbourhood operators),
+    and tags it with 'roi' meta so ResizeImage and CropImage place it correctly.
+    '''
+    def __init__(self, crop: CropImage, chain: list) -> None:
+        super().__init__('ROI Crop')
+        self._inputs.append(f.InputPin(self, 0))
+        self._outputs.append(f.OutputPin(self, 0))
+        self._crop = crop
+        self._chain = chain
+
+    def params(self) -> tuple:
+        return (self._crop.cropRect(),) + tuple((type(node).__name__, node.params()) for node in self._chain)
+
+    def _sizes(self, size: tuple) -> list:
+        sizes = [size]
+        for node in self._chain:
+            sizes.append(node.outputSize(sizes[-1]))
+        return sizes
+
+    def _neededRect(self, sizes: list, rect: tuple) -> tuple:
+        for index in reversed(range(len(self._chain))):
+            rect = self._chain[index].mapRectToInput(rect, sizes[index], sizes[index+1])
+        return (math.floor(rect[0]), math.floor(rect[1]), math.ceil(rect[2]), math.ceil(rect[3]))
+
+    def regionFor(self, size: tuple, dtype=np.uint8, rect: tuple=None) -> tuple:
+        '''Input (left, top, right, bottom) needed for an input of (width, height).'''
+        sizes = self._sizes(size)
+        left, top, right, bottom = self._neededRect(sizes, rect or self._crop.cropRect())
+        # snap to the grid on which the pixels of every stage line up (and the
+        # blocks of stages working on blocks, see Filter.inputGrid()), so the
+        # region is resized exactly like the same pixels of the full image;
+        # an axis without a usable grid is kept whole
+        width, height = size
+        grids = [node.inputGrid(sizes[index], sizes[index+1], dtype) for index, node in enumerate(self._chain)] + [(1, 1)]
+        qx = math.lcm(*(Fraction(w, width * g[0]).denominator for (w, _), g in zip(sizes, grids)))
+        qy = math.lcm(*(Fraction(h, height * g[1]).denominator for (_, h), g in zip(sizes, grids)))
+        if qx <= 128:
+            left, right = left - left % qx, right + (-right) % qx
+        else:
+            left, right = 0, width
+        if qy <= 128:
+            top, bottom = top - top % qy, bottom + (-bottom) % qy
+        else:
+            top, bottom = 0, height
+        return (max(0, left), max(0, top), min(width, right), min(height, bottom))
+
+    def covers(self, previous: tuple, rect: tuple) -> bool:
+        '''Whether the region cropped for the previous rect also holds everything rect needs.'''
+        frame = self._lastInputs.get(self.input())
+        if frame is None or previous is None or rect is None or 'tile' in frame.meta():
+            return False
+        height, width = frame.shape()[:2]
+        region = self.regionFor((width, height), frame.dtype(), previous)
+        if region[0] >= region[2] or region[1] >= region[3]:
+            region = (0, 0, width, height)  # passed through whole
+        left, top, right, bottom = self._neededRect(self._sizes((width, height)), rect)
+        return (max(0, left) >= region[0] and max(0, top) >= region[1]
+                and min(width, right) <= region[2] and min(height, bottom) <= region[3])
+
+    def exec(self, inputPin: f.InputPin, frame: f.Frame) -> None:
+        super().exec(inputPin, frame)
+        height, width = frame.shape()[:2]
+        region = self.regionFor((width, height), frame.dtype())
+        if 'tile' in frame.meta() or region == (0, 0, width, height) or region[0] >= region[2] or region[1] >= region[3]:
+            self.pushOne(f.Frame(frame.value(), self, inputPin, meta=frame.meta()))
+            return
+        cropped = cropArray(frame.value(), region)
+        meta = dict(frame.meta(), roi=(region[0], region[1], width, height))
+        self.pushOne(f.Frame(cropped, self, inputPin, meta=meta))
+
+
+def optimizeCrops(pipeline: f.Pipeline) -> int:
+    '''
+    Graph pass moving crops ahead of expensive stages: for every CropImage fed
+    by a chain of single-consumer ROI transparent filters (e.g. inpaint, resize),
+    inserts a RoiCrop in front of the chain so that the chain only processes
+    the pixels the crop keeps. Returns the number of crops optimized.
+    '''
+    producers = {}
+    for node in pipeline.nodes():
+        for outputPin in node.outputs():
+            for inputPin in outputPin.inputPins():
+                producers.setdefault(inputPin, []).append(outputPin)
+
+    count = 0
+    for crop in pipeline.nodes():
+        if not isinstance(crop, CropImage) or crop._roiCrop is not None:
+            continue
+        chain = []
+        inputPin = crop.input()
+        while len(producers.get(inputPin, [])) == 1:
+            outputPin = producers[inputPin][0]
+            parent = outputPin.parent()
+            if (not isinstance(parent, f.Filter) or not parent.ROI or len(outputPin.inputPins()) != 1
+                    or len(parent.inputs()) != 1 or len(parent.outputs()) != 1):
+                break
+            chain.insert(0, parent)
+            inputPin = parent.input()
+        if not chain or len(producers.get(inputPin, [])) != 1:
+            continue
+        outputPin = producers[inputPin][0]
+        roiCrop = RoiCrop(crop, chain)
+        outputPin.disconnect(inputPin)
+        outputPin.connect(roiCrop.input())
+        roiCrop.output().connect(inputPin)
+        crop._roiCrop = roiCrop
+        for node in chain:
+            node.addDependent(roiCrop)
+        count += 1
+    if count:
+        pipeline.invalidate()
+    return count
+
+
+def optimizeDecode(pipeline: f.Pipeline) -> int:
+    '''
+    Graph pass letting loaders decode at a reduced resolution: every LoadImage
+    whose single-consumer chain of ROI transparent filters (and RoiCrops)
+    leads to a ResizeImage gets that resize as its decode hint. The resize
+    still produces the exact output size. Returns the number of loaders hinted.
+    '''
+    count = 0
+    for loader in pipeline.nodes():
+        if not isinstance(loader, LoadImage) or loader.tileSize() is not None:
+            continue
+        node = loader
+        while len(node.outputs()) == 1 and len(node.output().inputPins()) == 1:
+            node = node.output().inputPins()[0].parent()
+            if isinstance(node, ResizeImage):
+                loader.setDecodeHint(node)
+                count += 1
+                break
+            if not isinstance(node, f.Filter) or not (node.ROI or isinstance(node, RoiCrop)) or len(node.inputs()) != 1:
+                break
+    return count
+
+
+def _rewire(outputPin: f.OutputPin, inputPin: f.InputPin, node: f.Filter) -> None:
+    # moves node out of the outputPin -> node -> consumers chain
+    outputPin.disconnect(inputPin)
+    for consumer in node.output().inputPins():
+        node.output().disconnect(consumer)
+        outputPin.connect(consumer)
+
+def negotiateFormats(pipeline: f.Pipeline) -> int:
+    '''
+    Graph pass matching the formats of output pins (see OutputPin.format())
+    to the formats input pins accept (see InputPin.formats()):
+    fuses back to back ConvertImages into one, drops those converting to the
+    format they receive, and converts for every input pin not surely
+    receiving a format it accepts, extending the ConvertImage feeding it
+    where there is one. Returns the number of changes.
+    '''
+    def producers():
+        pins = {}
+        for node in pipeline.nodes():
+            for outputPin in node.outputs():
+                for inputPin in outputPin.inputPins():
+                    pins.setdefault(inputPin, []).append(outputPin)
+        return pins
+
+    count = 0
+    changed = True
+    while changed:
+        changed = False
+        pins = producers()
+        for node in pipeline.nodes():
+            if not isinstance(node, ConvertImage) or len(pins.get(node.input(), [])) != 1:
+                continue
+            outputPin = pins[node.input()][0]
+            previous = outputPin.parent()
+            if (isinstance(previous, ConvertImage) and not previous.keepFormats()
+                    and len(outputPin.inputPins()) == 1 and len(pins.get(previous.input(), [])) == 1):
+                node.fuse(previous)
+                _rewire(pins[previous.input()][0], previous.input(), previous)
+            elif outputPin.format() is not None and node.steps(outputPin.format()) == [] \
+                    and node.input().accepts(outputPin.format()):
+                _rewire(outputPin, node.input(), node)
+            else:
+                continue
+            pipeline.invalidate()
+            count += 1
+            changed = True
+            break
+
+    for inputPin, outputPins in producers().items():
+        if inputPin.formats() is None:
+            continue
+        for outputPin in outputPins:
+            if inputPin.accepts(outputPin.format()):
+                continue
+            formats = inputPin.formats()
+            producer = outputPin.parent()
+            if isinstance(producer, ConvertImage) and len(outputPin.inputPins()) == 1:
+                producer.append(formats[0], formats)
+            else:
+                convert = ConvertImage(formats[0], keepFormats=formats)
+                outputPin.disconnect(inputPin)
+                outputPin.connect(convert.input())
+                convert.output().connect(inputPin)
+            count += 1
+    if count:
+        pipeline.invalidate()
+    return count
+
+
+SOBEL_OUTPUTS = ('magnitude', 'orientation')
+
+def sobelGradients(array: np.ndarray) -> tuple:
+    '''
+    Horizontal and vertical 3x3 Sobel gradients (gx, gy) as float32, over the
+    last two axes of a (h, w) image or an (N, h, w) stack, borders reflected
+    like OpenCV. Separable: a [1, 2, 1] smoothing and a [-1, 0, 1] difference.
+    '''
+    if array.ndim == 2:
+        return cv2.Sobel(array, cv2.CV_32F, 1, 0), cv2.Sobel(array, cv2.CV_32F, 0, 1)
+    padded = np.pad(array.astype(np.float32, copy=False),
+                    ((0, 0),) * (array.ndim - 2) + ((1, 1), (1, 1)), mode='reflect')
+    smoothed = padded[..., :-2, :] + 2 * padded[..., 1:-1, :] + padded[..., 2:, :]
+    gx = smoothed[..., 2:] - smoothed[..., :-2]
+    differences = padded[..., 2:, :] - padded[..., :-2, :]
+    gy = differences[..., :-2] + 2 * differences[..., 1:-1] + differences[..., 2:]
+    return gx, gy
 
 
 class SobelEdge(f.Filter):
-    def __init__(self) -> None:
+    '''
+    Sobel gradient magnitude and orientation (radians in [-pi, pi], 0 pointing
+    right, counter-clockwise with rows growing down) as float32 array frames,
+    one output pin per entry of outputs, so unwanted ones are not computed.
+    Accepts images and (N, h, w) region stacks (see RegionCrop), colour
+    images are reduced to luminance.
+    '''
+    REENTRANT = True
+
+    def __init__(self, outputs: tuple=SOBEL_OUTPUTS) -> None:
         super().__init__(f'Sobel Edge')
+        unknown = set(outputs) - set(SOBEL_OUTPUTS)
+        if unknown:
+            raise ValueError(f'Unknown Sobel outputs {unknown}, expected some of {SOBEL_OUTPUTS}')
         self._inputs.append(f.InputPin(self, 0))
-        self._outputs.append(f.OutputPin(self, 0))
-        self._outputs.append(f.OutputPin(self, 1))
+        self._computed = tuple(outputs)
+        for index in range(len(self._computed)):
+            self._outputs.append(f.OutputPin(self, index, format='F'))
+
+    def computed(self) -> tuple:
+        return self._computed
+
+    def params(self) -> tuple:
+        return self._computed
 
     def exec(self, inputPin: f.InputPin, frame: f.Frame):
         super().exec(inputPin, frame)
-        image = frame.value()
-        arrayed = np.asarray(image)
-        edged = dlib.sobel_edge_detector(arrayed)
-        self.pushMany([
-            f.Frame(Image.fromarray(edged[0]).convert('L'), self, inputPin),
-            f.Frame(Image.fromarray(edged[1]).convert('L'), self, inputPin)])
-        # length = len(self._outputs)
-        # if length > 0:
-        #     log.verbose('Pushing Sobel:0')
-        #     self.pushToPin(0, Image.fromarray(edged[0]).convert('L'))
-        #     if length > 1:
-        #         log.verbose('Pushing Sobel:1')
-        #         self.pushToPin(1, Image.fromarray(edged[1]).convert('L'))
+        value = frame.value()
+        batched = 'regions' in frame.meta()
+        if value.ndim == 3 + batched:
+            value = value[..., :3] @ np.array([0.299, 0.587, 0.114], np.float32)
+        gx, gy = sobelGradients(value)
+        results = {}
+        if 'magnitude' in self._computed:
+            results['magnitude'] = np.hypot(gx, gy)
+        if 'orientation' in self._computed:
+            results['orientation'] = np.arctan2(gy, gx)
+        self.pushMany([f.Frame(results[output], self, inputPin, meta=frame.meta())
+                       for output in self._computed])
+
+
+HISTOGRAM_MODES = ('luminance', 'channels')
+
+def luminance(array: np.ndarray) -> np.ndarray:
+    '''Luminance of (..., 3 or 4) colour pixels, rounded like PIL's 'L' conversion for integers.'''
+    if array.dtype.kind in 'ui':
+        # PIL's fixed point weights
+        weighted = array[..., :3].astype(np.int64) @ np.array([19595, 38470, 7471])
+        return ((weighted + 0x8000) >> 16).astype(array.dtype)
+    return (array[..., :3] @ np.array([0.299, 0.587, 0.114])).astype(array.dtype)
+
+def binIndices(array: np.ndarray, bins: int, valueRange: tuple=None) -> np.ndarray:
+    '''
+    The bin of every value, bins splitting valueRange (low, high) evenly. The
+    range defaults to the whole dtype range for integers, (0, 1) for floats.
+    Values outside the range fall into the first or last bin.
+    '''
+    if array.dtype.kind in 'ui':
+        low, high = valueRange or (np.iinfo(array.dtype).min, np.iinfo(array.dtype).max)
+        if array.dtype.kind == 'u' and array.dtype.itemsize <= 2:
+            # a lookup table over every possible value is cheaper than the arithmetic
+            values = np.arange(np.iinfo(array.dtype).max + 1)
+            table = np.clip((values - low) * bins // (high - low + 1), 0, bins - 1)
+            return table.astype(np.intp)[array]
+        indices = (array.astype(np.int64) - low) * bins // (high - low + 1)
+    else:
+        low, high = valueRange or (0.0, 1.0)
+        indices = np.floor((array - low) * (bins / (high - low))).astype(np.intp)
+    return np.clip(indices, 0, bins - 1)
+
+def histograms(array: np.ndarray, bins: int=256, valueRange: tuple=None, mask: np.ndarray=None,
+               batched: bool=False) -> np.ndarray:
+    '''
+    Counts of the values of an (h, w) or (h, w, C) image in bins with one
+    np.bincount call, (bins,) or (C, bins). With batched, array is an
+    (N, h, w[, C]) stack and the result (N, bins) or (N, C, bins). mask, an
+    (h, w) or (N, h, w) bool array, selects the pixels counted.
+    '''
+    leading = array.ndim - 2 - batched
+    if leading:
+        # channels first, so every (image, channel) is a contiguous group
+        array = np.moveaxis(array, -1, int(batched))
+    shape = array.shape[:-2]
+    groups = math.prod(shape)
+    indices = binIndices(array, bins, valueRange).reshape(groups, -1)
+    indices += (np.arange(groups) * bins)[:, None]
+    if mask is not None:
+        mask = np.broadcast_to(mask.reshape(mask.shape[:-2] + (1,) * leading + mask.shape[-2:]),
+                               array.shape).reshape(groups, -1)
+        indices = indices[mask]
+    return np.bincount(indices.ravel(), minlength=groups * bins).reshape(shape + (bins,))
 
 
 class Histogram(f.Filter):
-    def __init__(self) -> None:
+    '''
+    Histogram of an image in bins: of its luminance, or of each channel of a
+    colour image ((C, bins), mode 'channels'). Region stacks (see RegionCrop)
+    give one histogram per region, (N, bins), counting only their 'mask'
+    pixels. With cumulative, a second pin gets the cumulative histogram.
+    '''
+    REENTRANT = True
+
+    def __init__(self, bins: int=256, mode: str='luminance', valueRange: tuple=None,
+                 cumulative: bool=False) -> None:
         super().__init__('Histogram')
+        if mode not in HISTOGRAM_MODES:
+            raise ValueError(f'Unknown histogram mode {mode}, expected one of {HISTOGRAM_MODES}')
         self._inputs.append(f.InputPin(self, 0))
         self._outputs.append(f.OutputPin(self, 0))
+        if cumulative:
+            self._outputs.append(f.OutputPin(self, 1))
+        self._bins = bins
+        self._mode = mode
+        self._valueRange = valueRange
+        self._cumulative = cumulative
+
+    def bins(self) -> int:
+        return self._bins
+
+    def mode(self) -> str:
+        return self._mode
+
+    def params(self) -> tuple:
+        return (self._bins, self._mode, self._valueRange, self._cumulative)
+
+    def exec(self, inputPin: f.InputPin, frame: f.Frame):
+        super().exec(inputPin, frame)
+        meta = frame.meta()
+        batched = 'regions' in meta
+        # of a tile, only count the core: the overlap belongs to its neighbours
+        value = tileCore(frame)
+        if value.ndim > 2 + batched and self._mode == 'luminance':
+            value = luminance(value)
+        histogram = histograms(value, self._bins, self._valueRange, meta.get('mask'), batched)
+        if self._cumulative:
+            self.pushMany([f.Frame(histogram, self, inputPin, meta=meta),
+                           f.Frame(np.cumsum(histogram, axis=-1), self, inputPin, meta=meta)])
+        else:
+            self.pushOne(f.Frame(histogram, self, inputPin, meta=meta))
+
+
+def _tilesDone(meta: dict) -> dict:
+    return {key: value for key, value in meta.items() if key not in ('tile', 'core', 'tiles', 'size')}
+
+class StitchTiles(f.Filter):
+    '''
+    Assembles the cores of the tile frames of an image (see LoadImage tiling)
+    into one image, pushed once every tile arrived. Tiles may come in any order.
+    Other frames pass through.
+    '''
+    def __init__(self) -> None:
+        super().__init__('Stitch Tiles')
+        self._inputs.append(f.InputPin(self, 0))
+        self._outputs.append(f.OutputPin(self, 0))
+        self._image = None
+        self._cores = set()
+
+    def cacheKey(self, inputPin, frame: f.Frame) -> str:
+        return None
+
+    def exec(self, inputPin: f.InputPin, frame: f.Frame):
+        super().exec(inputPin, frame)
+        meta = frame.meta()
+        if 'tile' not in meta:
+            self.pushOne(f.Frame(frame.value(), self, inputPin, meta=meta))
+            return
+        if meta['core'] in self._cores:
+            # a tile seen before: the previous image was abandoned, start over
+            self._image, self._cores = None, set()
+        core = tileCore(frame)
+        if self._image is None:
+            width, height = meta['size']
+            self._image = np.empty((height, width) + core.shape[2:], core.dtype)
+        left, top, right, bottom = meta['core']
+        self._image[top:bottom, left:right] = core
+        self._cores.add(meta['core'])
+        if len(self._cores) == meta['tiles']:
+            image, self._image, self._cores = self._image, None, set()
+            self.pushOne(f.Frame(image, self, inputPin, meta=_tilesDone(meta)))
+
+
+class ReduceTiles(f.Filter):
+    '''
+    Combines the per-tile results of a tile-local filter (e.g. Histogram) with
+    reduce, by default summing them, and pushes the result once every tile of
+    the image arrived. Other frames pass through.
+    '''
+    def __init__(self, reduce=np.add) -> None:
+        super().__init__('Reduce Tiles')
+        self._inputs.append(f.InputPin(self, 0))
+        self._outputs.append(f.OutputPin(self, 0))
+        self._reduce = reduce
+        self._value = None
+        self._cores = set()
+
+    def cacheKey(self, inputPin, frame: f.Frame) -> str:
+        return None
 
     def exec(self, inputPin: f.InputPin, frame: f.Frame):
         super().exec(inputPin, frame)
-        image = frame.value()
-        arrayed = np.asarray(image)
-        histogram = dlib.get_histogram(arrayed, 256)
-        self.pushOne(f.Frame(histogram, self, inputPin))
+        meta = frame.meta()
+        if 'tile' not in meta:
+            self.pushOne(f.Frame(frame.value(), self, inputPin, meta=meta))
+            return
+        if meta['core'] in self._cores:
+            self._value, self._cores = None, set()
+        self._value = frame.value() if self._value is None else self._reduce(self._value, frame.value())
+        self._cores.add(meta['core'])
+        if len(self._cores) == meta['tiles']:
+            value, self._value, self._cores = self._value, None, set()
+            self.pushOne(f.Frame(value, self, inputPin, meta=_tilesDone(meta)))
 
 # class HistogramRenderer(f.Renderer):
 #     def __init__(self) -> None:
@@ -11,6 +11,7 @@ from PIL import Image
 import numpy as np
 from scipy.interpolate import interp1d
 import matplotlib.pyplot as plt
+from image_cache import sharedImageCache
 
 
 class ImageViewer(QGraphicsView):
@@ -161,7 +162,8 @@ class ImageViewer(QGraphicsView):
     def set_image(self, imagePath: str):
         self.scene().clear()
 
-        image_arr = Image.open(imagePath).convert('RGB')
+        # decoded once, shared with the pipeline and usually prefetched
+        image_arr = Image.fromarray(sharedImageCache().load(imagePath)).convert('RGB')
         data = image_arr.tobytes("raw", "RGB")
         qimage = QImage(data, image_arr.width,
                         image_arr.height, QImage.Format.Format_RGB888)
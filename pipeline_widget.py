@@ -1,13 +1,47 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from PyQt6.QtWidgets import (QWidget, QVBoxLayout, QHBoxLayout, QLabel, QScrollArea, QListWidget,
                              QListWidgetItem, QListView, QLineEdit, QGridLayout, QSizePolicy, QTableWidget)
-from PyQt6.QtCore import Qt, pyqtSignal, QSize
+from PyQt6.QtCore import Qt, pyqtSignal, QSize, QObject
 import PyQt6.QtCore as QtCore
 from PyQt6 import QtGui
-from PIL import Image, ImageQt
+from PIL import Image
 from histogram_widget import HistogramWidget, HistogramOrientation, GlcmWidget
 import filters as f
-import image_filters as fi
-import data_filters as di
+from pipelines import texturePipeline
+from log import ConsoleLog as log
+from filter_cache import ResultCache
+from image_cache import sharedImageCache
+
+class QtFilterAdapter(QObject):
+    '''
+    Bridges the callbacks of a Qt-free filter to Qt signals. Filters may run
+    on worker threads; connected slots are invoked on the receiver's thread.
+    Signals carry the id of the run that emitted them (see setRun()), so
+    receivers can drop events of abandoned runs.
+    '''
+    filter_executing = pyqtSignal(object, object, int)  # filter, frame, run
+    filter_executed = pyqtSignal(object, object, int)  # filter, frame, run
+
+    def __init__(self, filter: f.Filter, parent=None):
+        super().__init__(parent)
+        self._filter = filter
+        self._run = 0
+        filter.filter_executing.connect(self._executing)
+        filter.filter_executed.connect(self._executed)
+
+    def filter(self) -> f.Filter:
+        return self._filter
+
+    def setRun(self, run: int):
+        self._run = run
+
+    def _executing(self, filter, frame):
+        self.filter_executing.emit(filter, frame, self._run)
+
+    def _executed(self, filter, frame):
+        self.filter_executed.emit(filter, frame, self._run)
+
 
 class PipelineItemWidget(QWidget):
     item_selected = pyqtSignal(str)
@@ -97,6 +131,12 @@ class PipelineWidget(QScrollArea):
 
         self.settings = settings
 
+        # pipeline runs execute off the GUI thread, one at a time, latest wins
+        self._runner = ThreadPoolExecutor(1, thread_name_prefix='pipeline-run')
+        self._run = 0
+        self._cancel = None
+        self._adapters = []
+
         self.pipeline = defaultPipeline(self) if pipeline is None else pipeline
         self._columnRows = []
         # self.layout = QHBoxLayout()
@@ -104,18 +144,22 @@ class PipelineWidget(QScrollArea):
         #self.list_widget.currentItemChanged.connect(self.on_item_selected)
         #self.list_widget.itemActivated.connect(self.on_item_activated)
 
-    def _on_filter_executing(self, filter: f.Filter, inputFrame: f.Frame):
+    def _on_filter_executing(self, filter: f.Filter, inputFrame: f.Frame, run: int=0):
         # self._addItemToView(filter)
-        self._addFilterView(filter)
+        if run == self._run:
+            self._addFilterView(filter)
 
-    def _on_histogram_filter_executed(self, filter:f.Filter, outputFrame:f.Frame):
-        self._addHistogramFilterOutputView(filter, outputFrame)
+    def _on_histogram_filter_executed(self, filter:f.Filter, outputFrame:f.Frame, run: int=0):
+        if run == self._run:
+            self._addHistogramFilterOutputView(filter, outputFrame)
 
-    def _on_glcm_filter_executed(self, filter:f.Filter, outputFrame:f.Frame):
-        self._addGlcmFilterOutputView(filter, outputFrame)
+    def _on_glcm_filter_executed(self, filter:f.Filter, outputFrame:f.Frame, run: int=0):
+        if run == self._run:
+            self._addGlcmFilterOutputView(filter, outputFrame)
 
-    def _on_image_filter_executed(self, filter:f.Filter, outputFrame:f.Frame):
-        self._addImageFilterOutputView(filter, outputFrame)
+    def _on_image_filter_executed(self, filter:f.Filter, outputFrame:f.Frame, run: int=0):
+        if run == self._run:
+            self._addImageFilterOutputView(filter, outputFrame)
         #last_item = self.list_widget.item(row)
         #last_widget = self.list_widget.itemWidget(last_item)
         #self._addImageFrameToView(last_widget.list_widget, outputFrame)
@@ -143,20 +187,50 @@ class PipelineWidget(QScrollArea):
         #widget = self.list_widget.itemWidget(item)
         # self.item_activated.emit(widget.image_name)
         self._clearItems()
+        self.execute([file_path])
+
+    def execute(self, data):
+        '''
+        Runs the pipeline on a background thread. A previous run still in
+        progress is cancelled between two filters and its results are dropped.
+        '''
+        if self.pipeline is not None:
+            self._submit(lambda cancel: self.pipeline.exec(data, cancel))
+
+    def refresh(self):
+        '''Re-runs only the filters invalidated by parameter changes since the last run.'''
         if self.pipeline is not None:
-            self.pipeline.exec([file_path])
+            self._clearItems()
+            self._submit(self.pipeline.update)
+
+    def _submit(self, fn):
+        if self._cancel is not None:
+            self._cancel.set()
+        self._run += 1
+        self._cancel = threading.Event()
+        self._runner.submit(self._execute, self._run, fn, self._cancel)
+
+    def _execute(self, run, fn, cancel):
+        if cancel.is_set():
+            return
+        for adapter in self._adapters:
+            adapter.setRun(run)
+        try:
+            fn(cancel)
+        except f.Cancelled:
+            log.verbose(f'Pipeline run {run} cancelled')
+        except Exception as e:
+            log.error(f'Pipeline run {run} failed: {e}')
 
     @QtCore.pyqtSlot(QListWidgetItem)
     def on_item_activated(self, item):
         widget = self.list_widget.itemWidget(item)
         self.item_activated.emit(widget.image_name)
-        if self.pipeline is not None:
-            self.pipeline.exec([item])
+        self.execute([item])
 
     @QtCore.pyqtSlot(str)
     def on_file_selected(self, file_path):
-        if self.pipeline is not None:
-            self.pipeline.exec([file_path])
+        self.execute([file_path])
 
     @QtCore.pyqtSlot(QListWidgetItem)
     def on_item_selected(self, item):
@@ -196,7 +270,7 @@ class PipelineWidget(QScrollArea):
     def _addGlcmFilterOutputView(self, filter: f.Filter, frame: f.Frame):
         # item_widget = FilterItemWidget(self, filter)
         widget = GlcmWidget(self)
-        widget.setData(frame.value())
+        widget.setData(frame.value(), frame.meta())
         widget.setMinimumSize(300, 300)
         item_widget = FilterItemWidget(self, widget, filter, frame)
         item_widget.setMinimumSize(300, 300)
@@ -205,8 +279,7 @@ class PipelineWidget(QScrollArea):
     def _addImageFilterOutputView(self, filter: f.Filter, frame: f.Frame):
         widget = QLabel(self)
         name = f'{filter.name()}'
-        thumb_image = frame.value()
-        qimage = ImageQt.ImageQt(thumb_image)
+        qimage = frame.qimage()
         pixmap = QtGui.QPixmap.fromImage(qimage)
         pixmap = pixmap.scaled(
             300, 300, aspectRatioMode=Qt.AspectRatioMode.KeepAspectRatio)
@@ -283,38 +356,16 @@ class PipelineWidget(QScrollArea):
 
 
 def defaultPipeline(self: PipelineWidget):
-    source = f.Source()
-    loader = fi.LoadImage()
-    inprint = fi.ImageInpaint()
-    resize = fi.ResizeImage((1280, 960), True, False)
-    # crop = fi.CropImage((400, 300, 800, 700))
-    crop = fi.CropImage((160, 0, 960, 960))
-    # sobel = fi.SobelEdge()
-    histogram = fi.Histogram()
-    glcm = di.GlcmFilter()
-
-    # pipeline.connect(source.output(), loader.input())
-    # pipeline.connect(loader.output(), crop.input())
-    # pipeline.connect(crop.output(0), histogram.input())
-    # pipeline.connect(crop.output(1), glcm.input())
-    # pipeline.connect(glcm.output(0), ) # glcm.output[0] => image
-    # pipeline.connect(glcm.output(1), somefilter.input()) # glcm.output[1] => glcm
-
-    source.output().connect(loader.input())
-    loader.output().connect(inprint.input())
-    inprint.output().connect(resize.input())
-    resize.output().connect(crop.input())
-    crop.addOutput()
-    # crop.output(0).connect(sobel.input())
-    crop.output(0).connect(histogram.input())
-    crop.output(1).connect(glcm.input())
+    pipeline = texturePipeline(threads=4, cache=ResultCache(), imageCache=sharedImageCache())
+    crop = QtFilterAdapter(pipeline.find('Image Crop'), self)
+    histogram = QtFilterAdapter(pipeline.find('Histogram'), self)
+    glcm = QtFilterAdapter(pipeline.find('GLCM'), self)
+    self._adapters += [crop, histogram, glcm]
+
     crop.filter_executing.connect(self._on_filter_executing)
     crop.filter_executed.connect(self._on_image_filter_executed)
-    # sobel.filter_executing.connect(self._on_filter_executing)
-    # sobel.filter_executed.connect(self._on_image_filter_executed)
     histogram.filter_executing.connect(self._on_filter_executing)
     histogram.filter_executed.connect(self._on_histogram_filter_executed)
     glcm.filter_executed.connect(self._on_glcm_filter_executed)
 
-    pipeline = f.Pipeline(source)
     return pipeline
@@ -0,0 +1,43 @@
+import filters as f
+import image_filters as fi
+import data_filters as di
+from filter_cache import ResultCache
+from image_cache import ImageCache
+
+
+def texturePipeline(threads: int=0, processes: int=0, cache: ResultCache=None, optimize: bool=True,
+                    imageCache: ImageCache=None) -> f.Pipeline:
+    '''
+    Builds the headless texture graph:
+    Source -> Image Load -> Image Inprint -> Image Size -> Image Crop -> (Histogram, GLCM)
+    optimize moves the crop ahead of inpainting, see image_filters.optimizeCrops(),
+    and decodes images at the resolution of the resize, see optimizeDecode().
+    Colour images are converted for the GLCM, see image_filters.negotiateFormats().
+    imageCache shares decoded images with the viewers and the prefetcher.
+    Module level, so it can be used as a factory for batch worker processes.
+    '''
+    source = f.Source()
+    loader = fi.LoadImage()
+    inprint = fi.ImageInpaint()
+    resize = fi.ResizeImage((1280, 960), True, False)
+    crop = fi.CropImage((160, 0, 960, 960))
+    histogram = fi.Histogram()
+    glcm = di.GlcmFilter()
+
+    source.output().connect(loader.input())
+    loader.output().connect(inprint.input())
+    inprint.output().connect(resize.input())
+    resize.output().connect(crop.input())
+    crop.output().connect(histogram.input())
+    crop.output().connect(glcm.input())
+
+    pipeline = f.Pipeline(source, threads, processes, factory=texturePipeline)
+    if optimize:
+        fi.optimizeCrops(pipeline)
+        fi.optimizeDecode(pipeline)
+    fi.negotiateFormats(pipeline)
+    if cache is not None:
+        pipeline.setCache(cache)
+    if imageCache is not None:
+        loader.setImageCache(imageCache)
+    return pipeline
@@ -0,0 +1,105 @@
+import threading
+import time
+from filter_cache import sizeOf
+
+
+class FilterStats:
+    def __init__(self) -> None:
+        self.calls = 0
+        self.wallTime = 0.0
+        self.cpuTime = 0.0
+        self.bytesIn = 0
+        self.bytesOut = 0
+
+    def asDict(self) -> dict:
+        return dict(calls=self.calls, wallTime=self.wallTime, cpuTime=self.cpuTime,
+                    bytesIn=self.bytesIn, bytesOut=self.bytesOut)
+
+
+class PinStats:
+    def __init__(self) -> None:
+        self.frames = 0
+        self.bytes = 0
+
+    def asDict(self) -> dict:
+        return dict(frames=self.frames, bytes=self.bytes)
+
+
+class Profiler:
+    '''
+    Collects per filter wall time, CPU time, call counts and bytes in/out,
+    and per pin frame counts and bytes. Attach with Pipeline.setProfiler().
+    CPU time covers the executing thread plus work done in worker processes
+    through Filter.compute().
+    '''
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._filters = {}
+        self._pins = {}
+
+    def reset(self) -> None:
+        with self._lock:
+            self._filters = {}
+            self._pins = {}
+
+    def recordFilter(self, name: str, wallTime: float, cpuTime: float, bytesIn: int) -> None:
+        with self._lock:
+            stats = self._filters.setdefault(name, FilterStats())
+            stats.calls += 1
+            stats.wallTime += wallTime
+            stats.cpuTime += cpuTime
+            stats.bytesIn += bytesIn
+
+    def recordCpu(self, name: str, cpuTime: float) -> None:
+        with self._lock:
+            self._filters.setdefault(name, FilterStats()).cpuTime += cpuTime
+
+    def recordInput(self, filterName: str, pinId, value) -> int:
+        size = sizeOf(value)
+        self._recordPin(f'{filterName}:in{pinId}', size)
+        return size
+
+    def recordOutput(self, filterName: str, pinId, value) -> None:
+        size = sizeOf(value)
+        self._recordPin(f'{filterName}:out{pinId}', size)
+        with self._lock:
+            self._filters.setdefault(filterName, FilterStats()).bytesOut += size
+
+    def _recordPin(self, name: str, size: int) -> None:
+        with self._lock:
+            stats = self._pins.setdefault(name, PinStats())
+            stats.frames += 1
+            stats.bytes += size
+
+    def filterStats(self, name: str=None):
+        '''Stats of one filter, or a dict of all of them when name is None.'''
+        with self._lock:
+            if name is not None:
+                return self._filters.get(name)
+            return dict(self._filters)
+
+    def pinStats(self, name: str=None):
+        '''Stats of one pin ('Filter:in0', 'Filter:out0'), or a dict of all of them.'''
+        with self._lock:
+            if name is not None:
+                return self._pins.get(name)
+            return dict(self._pins)
+
+    def summary(self) -> str:
+        '''Table of filters sorted by wall time.'''
+        rows = sorted(self.filterStats().items(), key=lambda item: item[1].wallTime, reverse=True)
+        total = sum(stats.wallTime for _, stats in rows) or 1.0
+        lines = [f'{"Filter":<28}{"calls":>7}{"wall ms":>11}{"avg ms":>10}{"cpu ms":>11}{"wall %":>8}{"in MB":>10}{"out MB":>10}']
+        for name, stats in rows:
+            average = stats.wallTime / stats.calls if stats.calls else 0.0
+            lines.append(f'{name[:27]:<28}{stats.calls:>7}{stats.wallTime*1000:>11.1f}{average*1000:>10.1f}'
+                         f'{stats.cpuTime*1000:>11.1f}{stats.wallTime/total*100:>8.1f}'
+                         f'{stats.bytesIn/2**20:>10.2f}{stats.bytesOut/2**20:>10.2f}')
+        return '\n'.join(lines)
+
+
+def timedCall(fn, *args):
+    '''Runs fn(*args), returns (result, CPU seconds); used for work sent to worker processes.'''
+    start = time.process_time()
+    result = fn(*args)
+    return result, time.process_time() - start
@@ -0,0 +1,157 @@
+import json
+import math
+import os
+import time
+import numpy as np
+import cv2
+from PIL import Image
+import filters as f
+from log import ConsoleLog as log
+
+# like PIL's reducing_gap: integer reduction first, leaving at least this factor to resampling
+REDUCING_GAP = 2.0
+
+BENCHMARK_FILE = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'data', 'resize_benchmark.json')
+
+_PIL_DTYPES = ('uint8', 'uint16', 'int32', 'float32')
+_CV2_DTYPES = ('uint8', 'uint16', 'int16', 'float32', 'float64')
+
+
+def _factors(shape: tuple, size: tuple) -> tuple:
+    return (shape[1] / size[0], shape[0] / size[1])
+
+def reduceFactors(shape: tuple, size: tuple) -> tuple:
+    '''The integer reduction resizePil() applies before resampling, per axis.'''
+    fx, fy = _factors(shape, size)
+    return (max(1, int(fx / REDUCING_GAP)), max(1, int(fy / REDUCING_GAP)))
+
+def blockFactors(shape: tuple, size: tuple) -> tuple:
+    '''Integer (x, y) factors for resizeBlockMean(), None if the sizes are not integer multiples.'''
+    height, width = shape[:2]
+    if width % size[0] or height % size[1]:
+        return None
+    return (width // size[0], height // size[1])
+
+
+def resizePil(array: np.ndarray, size: tuple) -> np.ndarray:
+    '''Bicubic, downscales reduce by integer factors first (reducing_gap) where PIL can.'''
+    image = Image.fromarray(array)
+    gap = None if image.mode.startswith('I;16') else REDUCING_GAP
+    return f.imageToArray(image.resize(size, Image.Resampling.BICUBIC, reducing_gap=gap))
+
+def resizeCv2(array: np.ndarray, size: tuple) -> np.ndarray:
+    '''Area averaging for downscales, bilinear for upscales.'''
+    fx, fy = _factors(array.shape, size)
+    interpolation = cv2.INTER_AREA if fx >= 1 and fy >= 1 else cv2.INTER_LINEAR
+    return cv2.resize(array, size, interpolation=interpolation)
+
+def resizeBlockMean(array: np.ndarray, size: tuple) -> np.ndarray:
+    '''Mean of integer factor blocks, rounded for integer images.'''
+    bx, by = blockFactors(array.shape, size)
+    count = bx * by
+    if array.dtype.kind in 'ui':
+        bits = array.dtype.itemsize * 8 + math.ceil(math.log2(count + 1))
+        if array.dtype.kind == 'i':
+            accumulator = np.int16 if bits <= 16 else np.int32 if bits <= 32 else np.int64
+        else:
+            accumulator = np.uint16 if bits <= 16 else np.uint32 if bits <= 32 else np.int64
+    else:
+        accumulator = np.float64
+    # strided slices keep every addition a contiguous-ish vector operation
+    total = np.zeros((size[1], size[0]) + array.shape[2:], accumulator)
+    for y in range(by):
+        for x in range(bx):
+            total += array[y::by, x::bx]
+    if accumulator is np.float64:
+        return (total / count).astype(array.dtype)
+    return ((total + count // 2) // count).astype(array.dtype)
+
+
+BACKENDS = {
+    'pil': resizePil,
+    'cv2': resizeCv2,
+    'numpy': resizeBlockMean,
+}
+
+def supports(backend: str, dtype, shape: tuple, size: tuple) -> bool:
+    '''Whether backend resizes an array of dtype and shape to size (width, height).'''
+    dtype = np.dtype(dtype).name
+    if backend == 'pil':
+        return dtype in _PIL_DTYPES and (len(shape) == 2 or dtype == 'uint8')
+    if backend == 'cv2':
+        return dtype in _CV2_DTYPES
+    if backend == 'numpy':
+        return blockFactors(shape, size) is not None
+    return False
+
+
+_benchmark = None
+
+def _loadBenchmark() -> dict:
+    global _benchmark
+    if _benchmark is None:
+        try:
+            with open(BENCHMARK_FILE) as file:
+                _benchmark = json.load(file)
+        except (OSError, ValueError) as e:
+            log.warn(f'No resize benchmark, using PIL: {e}')
+            _benchmark = {}
+    return _benchmark
+
+def chooseBackend(dtype, shape: tuple, size: tuple) -> str:
+    '''
+    The fastest backend supporting the resize, according to the benchmark
+    bundled in data/ for the dtype and the nearest scale factor.
+    '''
+    factor = max(_factors(shape, size))
+    runs = _loadBenchmark().get(np.dtype(dtype).name)
+    ranking = []
+    if runs:
+        nearest = min(runs, key=lambda run: abs(math.log(run['factor'] / factor)))
+        ranking = sorted(nearest['seconds'], key=nearest['seconds'].get)
+    for backend in ranking + ['pil', 'cv2']:
+        if supports(backend, dtype, shape, size):
+            return backend
+    return 'pil'
+
+def resizeArray(array: np.ndarray, size: tuple, backend: str='auto') -> np.ndarray:
+    '''Resizes an image array to size (width, height) with a backend of BACKENDS, 'auto' chooses.'''
+    if backend == 'auto' or not supports(backend, array.dtype, array.shape, size):
+        backend = chooseBackend(array.dtype, array.shape, size)
+    return BACKENDS[backend](array, size)
+
+
+def benchmark(path: str=BENCHMARK_FILE, repeat: int=5) -> dict:
+    '''
+    Times every backend per dtype and scale factor on a 4800x3600 image and
+    writes the results to path. Run this module to refresh the bundled file.
+    '''
+    rng = np.random.default_rng(0)
+    width, height = 4800, 3600
+    results = {}
+    for dtype in ('uint8', 'uint16', 'float32'):
+        source = rng.integers(0, 255, (height, width)).astype(dtype)
+        runs = []
+        for factor in (0.5, 1.5, 2, 3, 3.75, 4, 6, 8):
+            size = (round(width / factor), round(height / factor))
+            seconds = {}
+            for backend, resize in BACKENDS.items():
+                if not supports(backend, source.dtype, source.shape, size):
+                    continue
+                resize(source, size)
+                start = time.perf_counter()
+                for _ in range(repeat):
+                    resize(source, size)
+                seconds[backend] = round((time.perf_counter() - start) / repeat, 6)
+            runs.append({'factor': factor, 'seconds': seconds})
+            log.info(f'{dtype} /{factor}: {seconds}')
+        results[dtype] = runs
+    with open(path, 'w') as file:
+        json.dump(results, file, indent=2)
+    global _benchmark
+    _benchmark = results
+    return results
+
+
+if __name__ == '__main__':
+    benchmark()